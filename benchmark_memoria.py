@@ -0,0 +1,130 @@
+"""Compara el consumo de memoria del perfil por defecto y del perfil LOW_MEMORY_MODE.
+
+Arranca el bot dos veces en subprocesos (con y sin LOW_MEMORY_MODE, ambos con
+MEMORY_TRACE=1), le inyecta el mismo tráfico simulado del gateway (un servidor
+con canales y miembros y una ráfaga de mensajes con embeds) y compara RSS,
+asignaciones de tracemalloc y tamaño de las cachés. No se conecta a Discord.
+
+Uso:
+    python benchmark_memoria.py --miembros 500 --mensajes 2000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+PROFILES = [("por defecto", ""), ("bajo consumo", "1")]
+
+
+def user_payload(i):
+    return {"id": str(10**17 + i), "username": f"user{i}", "discriminator": "0", "avatar": None, "global_name": f"User {i}"}
+
+
+def member_payload(i=None):
+    payload = {"roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0}
+    if i is not None:
+        payload["user"] = user_payload(i)
+    return payload
+
+
+def guild_payload(members, channels):
+    return {
+        "id": "1", "name": "Servidor simulado", "unavailable": False, "member_count": members,
+        "roles": [{"id": "1", "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(100 + c), "type": 0, "name": f"canal-{c}", "position": c, "permission_overwrites": []}
+                     for c in range(channels)],
+        "members": [member_payload(i) for i in range(members)],
+        "emojis": [], "features": [], "stickers": [], "threads": [], "voice_states": [], "presences": [],
+    }
+
+
+def message_payload(i, members, channels):
+    return {
+        "id": str(10**18 + i), "channel_id": str(100 + i % channels), "guild_id": "1",
+        "author": user_payload(i % members), "member": member_payload(),
+        "content": "", "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None,
+        "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+        "embeds": [{"title": f"User {i % members} received a drop", "description": "Twisted bow",
+                    "fields": [{"name": "Total value", "value": "1.2b", "inline": True}]}],
+        "pinned": False, "type": 0,
+    }
+
+
+def run_child(args):
+    """Se ejecuta dentro del subproceso: simula el tráfico y devuelve las métricas en JSON."""
+    # Importar el bot desde un directorio temporal para no crear config.json ni logs en el repo
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp(prefix="benchmark_memoria_"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        import bot
+    import tracemalloc
+
+    state = bot.bot._connection
+    state.dispatch = lambda *a, **k: None  # Sin eventos: sólo interesa lo que queda en caché
+
+    async def simulate():
+        state.parse_guild_create(guild_payload(args.miembros, args.canales))
+        for i in range(args.mensajes):
+            state.parse_message_create(message_payload(i, args.miembros, args.canales))
+
+    before, _ = tracemalloc.get_traced_memory()
+    asyncio.run(simulate())
+    current, peak = tracemalloc.get_traced_memory()
+    rss = bot.get_rss_bytes()
+    print(json.dumps({
+        "rss": rss,
+        "traced": current,
+        "traced_delta": current - before,
+        "peak": peak,
+        "messages": len(bot.bot.cached_messages),
+        "members": sum(len(g.members) for g in bot.bot.guilds),
+        "report": bot.build_memory_report(),
+    }))
+
+
+def main(args):
+    print(f"{args.miembros} miembros, {args.canales} canales, {args.mensajes} mensajes simulados\n")
+    results = []
+    for label, low_memory in PROFILES:
+        env = dict(os.environ, LOW_MEMORY_MODE=low_memory, MEMORY_TRACE="1", LOW_MEMORY_MAX_MESSAGES=str(args.max_mensajes))
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--hijo",
+             "--miembros", str(args.miembros), "--canales", str(args.canales), "--mensajes", str(args.mensajes)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        # El log del bot también escribe en stdout: el resultado es la última línea
+        results.append((label, json.loads(out.strip().splitlines()[-1])))
+
+    mib = lambda b: f"{b / 1024 / 1024:.1f} MiB" if b is not None else "n/d"
+    print(f"{'perfil':<16}{'RSS':>12}{'tracemalloc':>14}{'por tráfico':>14}{'mensajes':>10}{'miembros':>10}")
+    for label, r in results:
+        print(f"{label:<16}{mib(r['rss']):>12}{mib(r['traced']):>14}{mib(r['traced_delta']):>14}{r['messages']:>10}{r['members']:>10}")
+
+    (_, default), (_, low) = results
+    if default["rss"] and low["rss"]:
+        print(f"\nAhorro de RSS: {mib(default['rss'] - low['rss'])}, "
+              f"de asignaciones: {mib(default['traced'] - low['traced'])}")
+    if args.detalle:
+        for label, r in results:
+            print(f"\n--- {label} ---\n{r['report']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--miembros", type=int, default=500)
+    parser.add_argument("--canales", type=int, default=10)
+    parser.add_argument("--mensajes", type=int, default=2000)
+    parser.add_argument("--max-mensajes", type=int, default=0, help="LOW_MEMORY_MAX_MESSAGES para el perfil de bajo consumo.")
+    parser.add_argument("--detalle", action="store_true", help="Muestra también el informe completo de cada perfil.")
+    parser.add_argument("--hijo", action="store_true", help=argparse.SUPPRESS)
+    parsed = parser.parse_args()
+    if parsed.hijo:
+        run_child(parsed)
+    else:
+        main(parsed)
@@ -0,0 +1,113 @@
+"""Benchmark de los modos de reenvío contra un canal simulado.
+
+Compara bytes transferidos y latencia de los modos "forward", "url" y "upload"
+usando un canal y adjuntos falsos que simulan la latencia de la API de Discord
+y el ancho de banda del CDN. No se conecta a Discord.
+
+Uso:
+    python benchmark_reenvio.py --mensajes 10 --imagenes 2 --tamano-kb 1024
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+# Importar el bot desde un directorio temporal para no crear config.json ni logs en el repo
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="benchmark_reenvio_"))
+with contextlib.redirect_stdout(io.StringIO()):
+    import bot
+import discord
+
+API_LATENCY_SECONDS = 0.05          # Ida y vuelta de cada llamada a la API
+BANDWIDTH_BYTES_PER_SECOND = 10e6   # Ancho de banda de subida/bajada simulado
+
+
+class TransferStats:
+    def __init__(self):
+        self.downloaded = 0
+        self.uploaded = 0
+        self.api_calls = 0
+
+
+class MockAttachment:
+    def __init__(self, stats, index, size):
+        self.stats = stats
+        self.filename = f"drop_{index}.png"
+        self.size = size
+        self.width = 512
+        self.height = 512
+        self.url = f"https://cdn.discordapp.com/attachments/1/2/{self.filename}"
+
+    async def to_file(self):
+        await asyncio.sleep(API_LATENCY_SECONDS + self.size / BANDWIDTH_BYTES_PER_SECOND)
+        self.stats.downloaded += self.size
+        return discord.File(io.BytesIO(bytes(self.size)), filename=self.filename)
+
+
+class MockChannel:
+    def __init__(self, stats, allow_forward=True):
+        self.stats = stats
+        self.allow_forward = allow_forward
+        self.name = "canal-simulado"
+
+    async def send(self, content=None, embed=None, embeds=None, file=None):
+        size = file.fp.getbuffer().nbytes if file else 0
+        await asyncio.sleep(API_LATENCY_SECONDS + size / BANDWIDTH_BYTES_PER_SECOND)
+        self.stats.api_calls += 1
+        self.stats.uploaded += size
+
+
+class MockMessage:
+    def __init__(self, stats, message_id, images, image_size):
+        self.id = message_id
+        self.embeds = [discord.Embed(title="Zezima received a drop", description="Twisted bow")]
+        self.attachments = [MockAttachment(stats, i, image_size) for i in range(images)]
+
+    async def forward(self, ch):
+        await asyncio.sleep(API_LATENCY_SECONDS)
+        ch.stats.api_calls += 1
+        if not ch.allow_forward:
+            raise discord.HTTPException(SimpleNamespace(status=403, reason="Forbidden"), "El destino no admite reenvíos")
+
+
+async def run_mode(mode, messages, images, image_size, allow_forward):
+    stats = TransferStats()
+    ch = MockChannel(stats, allow_forward=allow_forward)
+    latencies = []
+    used = set()
+    for message_id in range(messages):
+        message = MockMessage(stats, message_id, images, image_size)
+        forward_content = [bot.ForwardItem("embed", message.embeds[0])]
+        forward_content += [bot.ForwardItem("attachment", a) for a in message.attachments]
+        start = time.perf_counter()
+        used.add(await bot.forward_message(message, ch, forward_content, mode))
+        latencies.append(time.perf_counter() - start)
+    return stats, latencies, used
+
+
+async def main(args):
+    scenarios = [("forward", True), ("forward", False), ("url", True), ("upload", True)]
+    print(f"{args.mensajes} mensajes, {args.imagenes} imágenes de {args.tamano_kb} KiB cada uno\n")
+    print(f"{'modo':<28}{'bajado':>12}{'subido':>12}{'llamadas':>10}{'media':>10}{'p95':>10}")
+    for mode, allow_forward in scenarios:
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats, latencies, used = await run_mode(mode, args.mensajes, args.imagenes, args.tamano_kb * 1024, allow_forward)
+        label = mode if allow_forward else f"{mode} (sin permiso -> {'/'.join(sorted(used))})"
+        p95 = sorted(latencies)[max(0, int(len(latencies) * 0.95) - 1)]
+        print(f"{label:<28}{stats.downloaded / 1024:>10.0f}Ki{stats.uploaded / 1024:>10.0f}Ki"
+              f"{stats.api_calls:>10}{statistics.mean(latencies) * 1000:>8.0f}ms{p95 * 1000:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mensajes", type=int, default=10)
+    parser.add_argument("--imagenes", type=int, default=2)
+    parser.add_argument("--tamano-kb", type=int, default=1024)
+    asyncio.run(main(parser.parse_args()))
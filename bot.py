@@ -1,6 +1,6 @@
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 import os
 from dotenv import load_dotenv
 import datetime
@@ -12,7 +12,21 @@ import requests
 from fuzzywuzzy import fuzz
 from bs4 import BeautifulSoup
 import time
+import hashlib
+import tracemalloc
+import cProfile
+import pstats
+import logging
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+import struct
+import itertools
+from collections import OrderedDict
+from array import array
 from pathlib import Path
+import numpy as np
 
 # =============================================
 # 1. Configuración inicial de archivos (NUEVO)
@@ -25,7 +39,9 @@ def setup_required_files():
             "reenvios_config": [],
             "last_processed_message_id": 0,
             "alias_map": {},
-            "channel_anything_id": None
+            "channel_anything_id": None,
+            "clan_members": [],
+            "price_alerts": []
         }
         with open("config.json", "w", encoding="utf-8") as f:
             json.dump(default_config, f, indent=2, ensure_ascii=False)
@@ -61,13 +77,38 @@ TOKEN = os.getenv("DISCORD_TOKEN")
 CONFIG_FILE = "config.json"
 LOG_FILE = "bot_activity.log"
 
-# Intents
-intents = discord.Intents.default()
-intents.message_content = True
-intents.messages = True
-
-# Bot
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Perfil de memoria: LOW_MEMORY_MODE=1 reduce las cachés de discord.py para VPS pequeños
+LOW_MEMORY_MODE = os.getenv("LOW_MEMORY_MODE", "").lower() in ("1", "true", "si", "sí", "yes")
+LOW_MEMORY_MAX_MESSAGES = int(os.getenv("LOW_MEMORY_MAX_MESSAGES") or 0) or None  # vacío o 0 = sin caché de mensajes
+MEMORY_TRACE = os.getenv("MEMORY_TRACE", "").lower() in ("1", "true", "si", "sí", "yes")
+
+if MEMORY_TRACE:
+    # Arrancar antes de crear el bot para contabilizar también sus cachés
+    tracemalloc.start()
+
+if LOW_MEMORY_MODE:
+    # Sólo lo necesario: canales (get_channel), mensajes de servidor y su contenido.
+    # Sin caché de miembros, sin chunking al iniciar y caché de mensajes limitada o desactivada.
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.message_content = True
+
+    bot = commands.Bot(
+        command_prefix="!",
+        intents=intents,
+        max_messages=LOW_MEMORY_MAX_MESSAGES,
+        member_cache_flags=discord.MemberCacheFlags.none(),
+        chunk_guilds_at_startup=False
+    )
+else:
+    # Intents
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.messages = True
+
+    # Bot
+    bot = commands.Bot(command_prefix="!", intents=intents)
 tree = bot.tree
 
 # Variables de configuración global
@@ -75,12 +116,123 @@ bot_config = {
     "reenvios_config": [],
     "last_processed_message_id": 0,
     "alias_map": {},
-    "channel_anything_id": None
+    "channel_anything_id": None,
+    "clan_members": [],
+    "price_alerts": []
 }
 
+# Modos de reenvío, en orden de preferencia: reenvío nativo de Discord, embeds
+# que apuntan a la URL del CDN original y, como último recurso, volver a subir
+FORWARD_MODES = ("forward", "url", "upload")
+
+# Registros con __slots__ para el estado propio del bot (sin __dict__ por instancia)
+class HiscoreRow:
+    """Fila del perfil personal de Hiscores: (rango, nivel/kc, xp) y la imagen."""
+    __slots__ = ("values", "img")
+
+    def __init__(self, values, img):
+        self.values = values
+        self.img = img
+
+class CacheEntry:
+    __slots__ = ("value", "timestamp")
+
+    def __init__(self, value, timestamp):
+        self.value = value
+        self.timestamp = timestamp
+
+class ForwardingRule:
+    """Regla de reenvío preprocesada a partir de su entrada en config.json."""
+    __slots__ = ("name", "channel_id", "keywords", "min_value_gp", "specific_levels", "forward_mode")
+
+    def __init__(self, rule):
+        self.name = rule.get("name", "sin nombre")
+        self.channel_id = rule.get("channel_id")
+        self.keywords = tuple(k.lower() for k in rule.get("keywords", []))
+        self.min_value_gp = rule.get("min_value_gp", 0)
+        specific_levels = rule.get("specific_levels", None)
+        self.specific_levels = frozenset(specific_levels) if specific_levels is not None else None
+        forward_mode = rule.get("forward_mode", "upload")
+        self.forward_mode = forward_mode if forward_mode in FORWARD_MODES else "upload"
+
+class ForwardItem:
+    """Elemento pendiente de reenviar: un embed o un adjunto (discord.Attachment)."""
+    __slots__ = ("type", "data")
+
+    def __init__(self, type, data):
+        self.type = type
+        self.data = data
+
+# Reglas de reenvío preprocesadas (se reconstruyen al cambiar reenvios_config)
+compiled_rules_cache = {"source": None, "rules": []}
+
 # CACHE para Hiscores de jugadores
 player_hiscores_cache = {}
 CACHE_EXPIRY_SECONDS = 300  # 5 minutos
+HISCORES_PERSONAL_URL = "https://secure.runescape.com/m=hiscore_oldschool/hiscorepersonal?user1={}"
+HISCORES_LITE_URL = "https://secure.runescape.com/m=hiscore_oldschool/index_lite.ws?player={}"
+
+# RESILIENCIA de APIs externas: caché stale-while-revalidate + circuit breaker
+UPSTREAM_MAX_STALE_SECONDS = 86400    # Hasta cuándo se sirven datos caducados
+UPSTREAM_STALE_GRACE_SECONDS = 0.3    # Espera máxima al refresco antes de servir datos caducados
+CIRCUIT_FAILURE_THRESHOLD = 3         # Fallos seguidos para abrir el circuito
+CIRCUIT_RESET_SECONDS = 30            # Tiempo abierto antes de dejar pasar una petición de prueba
+
+# PLANIFICADOR de peticiones: token bucket por host y clases de prioridad
+HISCORES_HOST = "secure.runescape.com"
+WIKI_PRICES_HOST = "prices.runescape.wiki"
+PRIORITY_INTERACTIVE = 0              # Comandos de un usuario
+PRIORITY_BULK = 1                     # Consultas masivas (leaderboard)
+PRIORITY_BACKGROUND = 2               # Recolectores periódicos
+UPSTREAM_MAX_QUEUE_SECONDS = {PRIORITY_INTERACTIVE: 2, PRIORITY_BULK: 30, PRIORITY_BACKGROUND: 120}
+UPSTREAM_INTERACTIVE_RESERVE = 1      # Tokens que el trabajo no interactivo deja libres
+
+# LEADERBOARD del clan: límites para las consultas masivas a Hiscores
+LEADERBOARD_CONCURRENCY = 5           # Consultas simultáneas como máximo (el ritmo lo limita el planificador)
+LEADERBOARD_PAGE_SIZE = 10
+
+# Hilos para las llamadas bloqueantes a APIS externas, separados por prioridad para que una
+# API lenta en trabajo masivo no deje a los comandos esperando en el executor por defecto
+UPSTREAM_WORKERS = {
+    PRIORITY_INTERACTIVE: 4,
+    PRIORITY_BULK: LEADERBOARD_CONCURRENCY,
+    PRIORITY_BACKGROUND: 2,           # Recolector de precios + recolector de ganancias
+}
+
+# HISTORIAL DE PRECIOS: muestras periódicas de la tabla de precios de la wiki
+PRICE_HISTORY_DIR = "price_history"
+PRICE_HISTORY_INTERVAL_MINUTES = 10
+WIKI_LATEST_URL = "https://prices.runescape.wiki/api/v1/osrs/latest"
+WIKI_MAPPING_URL = "https://prices.runescape.wiki/api/v1/osrs/mapping"
+ITEM_MAPPING_EXPIRY_SECONDS = 6 * 3600
+
+# GANANCIAS del clan: snapshots periódicos de Hiscores con codificación delta
+GAINS_DIR = "gains"
+GAINS_INTERVAL_HOURS = 1
+GAINS_KEYFRAME_INTERVAL = 24          # Un snapshot completo cada 24 (el resto son deltas)
+GAINS_INDEX_CACHE_SIZE = 8            # Jugadores con el índice completo en memoria (para /gains)
+GAINS_PERIODS = {"1d": 86400, "7d": 7 * 86400, "30d": 30 * 86400}
+HISCORES_JSON_URL = "https://secure.runescape.com/m=hiscore_oldschool/index_lite.json?player={}"
+weekly_gains = {"week_start": 0, "gains": {}, "names": {}}  # gains/names por gains_player_key
+
+# ALERTAS DE PRECIO
+PRICE_ALERT_COOLDOWN_SECONDS = 3600   # Mínimo entre dos avisos de la misma alerta
+PRICE_ALERT_HYSTERESIS = 0.02         # El precio debe retroceder un 2% para rearmar la alerta
+
+# PERFILADO bajo demanda (/profile)
+PROFILE_DIR = "profiles"
+PROFILE_MAX_SECONDS = 600             # La sesión se detiene sola pasado este tiempo
+PROFILE_MAX_SLOW_CALLBACKS = 1000     # Límite de callbacks lentos guardados por sesión
+
+# DEDUPLICACIÓN de drops reenviados (huellas recientes, ordenadas por antigüedad)
+recent_drop_fingerprints = OrderedDict()
+DEDUP_WINDOW_SECONDS = 600  # 10 minutos
+DEDUP_MAX_ENTRIES = 5000
+forwarding_stats = {
+    "duplicados_omitidos": 0,
+    "bytes_subidos": 0,
+    "reenvios_por_modo": {"forward": 0, "url": 0, "upload": 0}
+}
 
 def log_action(action, message=None, exception_obj=None):
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -117,6 +269,8 @@ def load_config():
             bot_config["last_processed_message_id"] = loaded_config.get("last_processed_message_id", 0)
             bot_config["alias_map"] = loaded_config.get("alias_map", {})
             bot_config["channel_anything_id"] = loaded_config.get("channel_anything_id", None) # Cargar el nuevo ID del canal
+            bot_config["clan_members"] = loaded_config.get("clan_members", [])
+            bot_config["price_alerts"] = loaded_config.get("price_alerts", [])
 
             log_action("CARGA DE CONFIGURACIÓN", f"Cargado {CONFIG_FILE} exitosamente.")
         except json.JSONDecodeError as e:
@@ -125,7 +279,9 @@ def load_config():
                 "reenvios_config": [],
                 "last_processed_message_id": 0,
                 "alias_map": {},
-                "channel_anything_id": None # Inicializar en caso de corrupción
+                "channel_anything_id": None, # Inicializar en caso de corrupción
+                "clan_members": [],
+                "price_alerts": []
             }
             save_config() # Guardar una configuración vacía para prevenir futuros errores
         except Exception as e:
@@ -134,7 +290,9 @@ def load_config():
                 "reenvios_config": [],
                 "last_processed_message_id": 0,
                 "alias_map": {},
-                "channel_anything_id": None # Inicializar en caso de error
+                "channel_anything_id": None, # Inicializar en caso de error
+                "clan_members": [],
+                "price_alerts": []
             }
             save_config()
     else:
@@ -143,7 +301,9 @@ def load_config():
             "reenvios_config": [],
             "last_processed_message_id": 0,
             "alias_map": {},
-            "channel_anything_id": None # Inicializar si no existe config.json
+            "channel_anything_id": None, # Inicializar si no existe config.json
+            "clan_members": [],
+            "price_alerts": []
         }
         
     # --- Migration Logic ---
@@ -220,6 +380,14 @@ def get_reenvios_config():
     log_action("ACCESO CONFIG", "Obteniendo reglas de reenvío.")
     return bot_config["reenvios_config"]
 
+def get_forwarding_rules():
+    """Devuelve las reglas preprocesadas, reconstruyéndolas si la configuración cambió."""
+    rules_config = get_reenvios_config()
+    if compiled_rules_cache["source"] is not rules_config:
+        compiled_rules_cache["rules"] = [ForwardingRule(rule) for rule in rules_config]
+        compiled_rules_cache["source"] = rules_config
+    return compiled_rules_cache["rules"]
+
 def set_reenvios_config(new_config):
     log_action("ACTUALIZANDO CONFIG", "Estableciendo nuevas reglas de reenvío.")
     bot_config["reenvios_config"] = new_config
@@ -234,6 +402,24 @@ def set_alias_map(new_map):
     bot_config["alias_map"] = new_map
     save_config()
 
+def get_clan_members():
+    log_action("ACCESO CONFIG", "Obteniendo lista de miembros del clan.")
+    return bot_config["clan_members"]
+
+def set_clan_members(new_members):
+    log_action("ACTUALIZANDO CONFIG", "Estableciendo nueva lista de miembros del clan.")
+    bot_config["clan_members"] = new_members
+    save_config()
+
+def get_price_alerts():
+    log_action("ACCESO CONFIG", "Obteniendo alertas de precio.")
+    return bot_config["price_alerts"]
+
+def set_price_alerts(new_alerts):
+    log_action("ACTUALIZANDO CONFIG", f"Estableciendo {len(new_alerts)} alertas de precio.")
+    bot_config["price_alerts"] = new_alerts
+    save_config()
+
 def get_last_processed_id():
     log_action("ACCESO CONFIG", "Obteniendo último ID de mensaje procesado.")
     return bot_config["last_processed_message_id"]
@@ -247,6 +433,128 @@ def set_last_processed_id(message_id):
     else:
         log_action("ACTUALIZACIÓN ÚLTIMO ID", f"El nuevo ID {message_id} no es mayor que el actual {bot_config['last_processed_message_id']}. No se actualiza.")
 
+def _normalize_text(text):
+    """Normaliza texto para comparar drops: minúsculas y espacios colapsados."""
+    return " ".join((text or "").lower().split())
+
+def compute_drop_fingerprint(message):
+    """Calcula una huella del contenido del mensaje sin descargar adjuntos.
+
+    Usa el título, descripción y campos normalizados del primer embed, el texto
+    del mensaje y los metadatos de los adjuntos (nombre, tamaño y dimensiones).
+    Devuelve None si el mensaje no tiene nada que comparar.
+    """
+    parts = []
+    if message.embeds:
+        embed = message.embeds[0]
+        parts.append(_normalize_text(embed.title))
+        parts.append(_normalize_text(embed.description))
+        for f in embed.fields:
+            parts.append(f"{_normalize_text(f.name)}={_normalize_text(f.value)}")
+    parts.append(_normalize_text(message.content))
+    for attachment in message.attachments:
+        parts.append(f"{attachment.filename.lower()}:{attachment.size}:{attachment.width}x{attachment.height}")
+
+    if not any(parts):
+        return None
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def is_duplicate_drop(fingerprint):
+    """Indica si la huella ya se vio dentro de la ventana y la registra si no."""
+    now = time.time()
+    # Expirar huellas fuera de la ventana (las más antiguas están al principio)
+    while recent_drop_fingerprints:
+        _, seen_at = next(iter(recent_drop_fingerprints.items()))
+        if now - seen_at < DEDUP_WINDOW_SECONDS:
+            break
+        recent_drop_fingerprints.popitem(last=False)
+
+    if fingerprint in recent_drop_fingerprints:
+        return True
+
+    recent_drop_fingerprints[fingerprint] = now
+    if len(recent_drop_fingerprints) > DEDUP_MAX_ENTRIES:
+        recent_drop_fingerprints.popitem(last=False)
+    return False
+
+def forget_drop(fingerprint):
+    """Olvida una huella cuyo reenvío falló, para que una nueva publicación del drop sí se reenvíe."""
+    if recent_drop_fingerprints.pop(fingerprint, None) is not None:
+        log_action("DUPLICADO", "Reenvío fallido: se olvida la huella del drop para permitir reintentos.")
+
+
+# Cada modo cuenta en progress["enviados"] los mensajes que ya llegaron al destino,
+# para no recurrir a otro modo (y duplicar el reenvío) después de un envío parcial.
+
+async def send_forward_native(message, ch, forward_content, progress):
+    """Reenvío nativo de Discord: no transfiere ningún archivo."""
+    await message.forward(ch)
+    progress["enviados"] += 1
+    log_action("REENVÍO PASO", f"Mensaje reenviado de forma nativa a {ch.name}.")
+    return 0
+
+async def send_forward_url(message, ch, forward_content, progress):
+    """Reenvía los embeds y muestra las imágenes desde su URL en el CDN, sin descargarlas."""
+    embeds = []
+    for item in forward_content:
+        if item.type == "embed":
+            embeds.append(item.data)
+        elif item.type == "attachment":
+            embeds.append(discord.Embed().set_image(url=item.data.url))
+    for i in range(0, len(embeds), 10):  # Discord admite hasta 10 embeds por mensaje
+        await ch.send(embeds=embeds[i:i + 10])
+        progress["enviados"] += 1
+    log_action("REENVÍO PASO", f"{len(embeds)} embeds (imágenes por URL) reenviados a {ch.name}.")
+    return 0
+
+async def send_forward_upload(message, ch, forward_content, progress):
+    """Descarga y vuelve a subir cada imagen. Devuelve los bytes subidos."""
+    uploaded = 0
+    for item in forward_content:
+        if item.type == "embed":
+            await ch.send(embed=item.data)
+            progress["enviados"] += 1
+            log_action("REENVÍO PASO", f"Embed reenviado a {ch.name}.")
+        elif item.type == "attachment":
+            # Un discord.File se consume al enviarlo, así que se crea uno por destino
+            await ch.send(file=await item.data.to_file())
+            progress["enviados"] += 1
+            uploaded += item.data.size
+            log_action("REENVÍO PASO", f"Adjunto (imagen) reenviado a {ch.name}.")
+    return uploaded
+
+FORWARD_SENDERS = {"forward": send_forward_native, "url": send_forward_url, "upload": send_forward_upload}
+
+def is_forward_mode_rejected(error):
+    """Indica si el destino rechazó el modo (sin permisos o petición inválida, p. ej. "no se puede reenviar").
+
+    Los 5xx y los límites de frecuencia no cuentan: Discord pudo haber publicado el mensaje igualmente.
+    """
+    return error.status in (400, 403)
+
+async def forward_message(message, ch, forward_content, mode):
+    """Reenvía con el modo pedido y recurre a los siguientes si el destino no lo permite.
+
+    Sólo se cambia de modo si el destino rechazó el actual sin que se enviara nada;
+    cualquier otro error se propaga para no duplicar el reenvío.
+    Devuelve el modo que se usó finalmente.
+    """
+    last_error = None
+    for step in FORWARD_MODES[FORWARD_MODES.index(mode):]:
+        progress = {"enviados": 0}
+        try:
+            uploaded = await FORWARD_SENDERS[step](message, ch, forward_content, progress)
+        except discord.HTTPException as e:
+            if progress["enviados"] or not is_forward_mode_rejected(e):
+                raise
+            log_action("ADVERTENCIA", f"Modo de reenvío '{step}' no disponible en {ch.name}: {e}. Probando el siguiente.")
+            last_error = e
+            continue
+        forwarding_stats["bytes_subidos"] += uploaded
+        forwarding_stats["reenvios_por_modo"][step] += 1
+        return step
+    raise last_error
+
 
 async def process_message_for_forwarding(message):
     log_action("PROCESANDO MENSAJE", f"Iniciando procesamiento para mensaje ID: {message.id} del canal: {message.channel.name if not isinstance(message.channel, discord.DMChannel) else 'DM'}") # Updated logging
@@ -280,6 +588,14 @@ async def process_message_for_forwarding(message):
 
     log_action("PROCESANDO MENSAJE", f"Mensaje ID {message.id} del canal {message.channel.name} apto para análisis de reenvío.")
 
+    # Deduplicación por contenido ANTES de descargar adjuntos o enviar nada
+    fingerprint = compute_drop_fingerprint(message)
+    if fingerprint and is_duplicate_drop(fingerprint):
+        forwarding_stats["duplicados_omitidos"] += 1
+        log_action("DUPLICADO", f"Mensaje ID {message.id} tiene el mismo contenido que un drop reciente. Ignorando. Total omitidos: {forwarding_stats['duplicados_omitidos']}.")
+        set_last_processed_id(message.id)
+        return
+
     forward_content = []
     text_for_rules = ""
     total_gp = 0
@@ -288,7 +604,7 @@ async def process_message_for_forwarding(message):
     if message.embeds:
         log_action("ANÁLISIS MENSAJE", f"Mensaje ID {message.id} contiene embeds. Procesando el primer embed.")
         embed = message.embeds[0]
-        forward_content.append({"type": "embed", "data": embed})
+        forward_content.append(ForwardItem("embed", embed))
         text_for_rules += (embed.title or "") + (embed.description or "")
         log_action("ANÁLISIS MENSAJE", f"Texto del embed extraído: '{text_for_rules[:50]}...'")
 
@@ -320,7 +636,8 @@ async def process_message_for_forwarding(message):
         for attachment in message.attachments:
             if attachment.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
                 log_action("ANÁLISIS MENSAJE", f"Adjunto '{attachment.filename}' es una imagen. Preparando para reenvío.")
-                forward_content.append({"type": "file", "data": await attachment.to_file()})
+                # Sólo se descarga si alguna regla acaba necesitando subirlo (modo "upload")
+                forward_content.append(ForwardItem("attachment", attachment))
             else:
                 log_action("ADVERTENCIA", f"Adjunto '{attachment.filename}' no es una imagen compatible. Ignorado.")
     else:
@@ -338,53 +655,52 @@ async def process_message_for_forwarding(message):
 
     log_action("APLICANDO REGLAS", f"Aplicando reglas de reenvío al mensaje ID {message.id}.")
     found_rule_match = False
-    for rule in get_reenvios_config():
-        log_action("EVALUANDO REGLA", f"Evaluando regla '{rule.get('name', 'sin nombre')}' para mensaje ID {message.id}.")
-        kw = [k.lower() for k in rule.get("keywords", [])]
-        min_gp = rule.get("min_value_gp", 0)
-        specific_levels = rule.get("specific_levels", None)
+    forward_failed = False
+    for rule in get_forwarding_rules():
+        log_action("EVALUANDO REGLA", f"Evaluando regla '{rule.name}' para mensaje ID {message.id}.")
+        kw = rule.keywords
+        min_gp = rule.min_value_gp
+        specific_levels = rule.specific_levels
 
         keyword_match = any(k in text_for_rules for k in kw)
         gp_met = total_gp >= min_gp
         
-        log_action("EVALUANDO REGLA", f"Regla '{rule.get('name', 'sin nombre')}': Palabras clave ({kw}) = {keyword_match}, GP mínimo ({min_gp}) = {gp_met}, GP del mensaje = {total_gp}.")
+        log_action("EVALUANDO REGLA", f"Regla '{rule.name}': Palabras clave ({kw}) = {keyword_match}, GP mínimo ({min_gp}) = {gp_met}, GP del mensaje = {total_gp}.")
 
         should_forward = keyword_match and gp_met
 
         if should_forward and specific_levels is not None:
             if lvl is not None:
                 if lvl not in specific_levels:
-                    log_action("EVALUANDO REGLA", f"Regla '{rule.get('name', 'sin nombre')}': Nivel {lvl} NO está en niveles específicos {specific_levels}. No se reenviará por esta regla.")
+                    log_action("EVALUANDO REGLA", f"Regla '{rule.name}': Nivel {lvl} NO está en niveles específicos {sorted(specific_levels)}. No se reenviará por esta regla.")
                     should_forward = False
                 else:
-                    log_action("EVALUANDO REGLA", f"Regla '{rule.get('name', 'sin nombre')}': Nivel {lvl} COINCIDE con niveles específicos {specific_levels}.")
+                    log_action("EVALUANDO REGLA", f"Regla '{rule.name}': Nivel {lvl} COINCIDE con niveles específicos {sorted(specific_levels)}.")
             else:
-                log_action("EVALUANDO REGLA", f"Regla '{rule.get('name', 'sin nombre')}': Se requieren niveles específicos pero no se detectó nivel en el mensaje. No se reenviará por esta regla.")
+                log_action("EVALUANDO REGLA", f"Regla '{rule.name}': Se requieren niveles específicos pero no se detectó nivel en el mensaje. No se reenviará por esta regla.")
                 should_forward = False
 
         if should_forward:
             found_rule_match = True
-            channel_id_to_forward = rule["channel_id"]
+            channel_id_to_forward = rule.channel_id
             ch = bot.get_channel(channel_id_to_forward)
             if ch:
-                log_action("REENVÍO INICIADO", f"Mensaje ID {message.id} coincide con regla '{rule['name']}'. Reenviando a canal ID {channel_id_to_forward} ({ch.name}).")
+                log_action("REENVÍO INICIADO", f"Mensaje ID {message.id} coincide con regla '{rule.name}'. Reenviando a canal ID {channel_id_to_forward} ({ch.name}).")
                 try:
                     await asyncio.sleep(1) # Small delay to prevent rate limits
 
-                    for item in forward_content:
-                        if item["type"] == "embed":
-                            await ch.send(embed=item["data"])
-                            log_action("REENVÍO PASO", f"Embed reenviado a {ch.name}.")
-                        elif item["type"] == "file":
-                            await ch.send(file=item["data"])
-                            log_action("REENVÍO PASO", f"Adjunto (imagen) reenviado a {ch.name}.")
-                    
-                    log_action("REENVÍO OK", f"Mensaje {message.id} reenviado exitosamente a {ch.name} por regla '{rule['name']}'.")
+                    mode_used = await forward_message(message, ch, forward_content, rule.forward_mode)
+                    log_action("REENVÍO OK", f"Mensaje {message.id} reenviado exitosamente a {ch.name} por regla '{rule.name}' (modo '{mode_used}').")
                 except Exception as e:
-                    log_action("ERROR", f"Al reenviar mensaje {message.id} a {ch.name} por regla '{rule['name']}'", exception_obj=e)
+                    forward_failed = True
+                    log_action("ERROR", f"Al reenviar mensaje {message.id} a {ch.name} por regla '{rule.name}'", exception_obj=e)
             else:
-                log_action("ERROR", f"Canal de destino ID {channel_id_to_forward} para la regla '{rule['name']}' no encontrado. No se pudo reenviar el mensaje {message.id}.")
+                forward_failed = True
+                log_action("ERROR", f"Canal de destino ID {channel_id_to_forward} para la regla '{rule.name}' no encontrado. No se pudo reenviar el mensaje {message.id}.")
     
+    if forward_failed and fingerprint:
+        forget_drop(fingerprint)
+
     if not found_rule_match:
         log_action("APLICANDO REGLAS", f"Mensaje ID {message.id}: No hubo coincidencias con ninguna regla de reenvío.")
         
@@ -395,6 +711,7 @@ async def process_message_for_forwarding(message):
 async def on_ready():
     log_action("EVENTO BOT", f"Bot conectado como {bot.user} (ID: {bot.user.id}).")
     load_config() # Asegura que la configuración, incluyendo channel_anything_id, esté cargada
+    price_alert_engine.load(get_price_alerts()) # load_config crea dicts nuevos: el motor debe usar esos
     try:
         log_action("COMANDOS SLASH", "Intentando sincronizar comandos slash.")
         await tree.sync()
@@ -402,6 +719,17 @@ async def on_ready():
     except Exception as e:
         log_action("ERROR", "Al sincronizar comandos slash", exception_obj=e)
     
+    if not gains_collector.is_running():
+        load_weekly_gains()
+        gains_collector.start()
+        log_action("INICIO BOT", f"Recolector de ganancias del clan iniciado (cada {GAINS_INTERVAL_HOURS} h).")
+
+    if not price_history_collector.is_running():
+        price_history_collector.start()
+        log_action("INICIO BOT", f"Recolector de historial de precios iniciado (cada {PRICE_HISTORY_INTERVAL_MINUTES} minutos).")
+
+    log_action("INFORME MEMORIA", build_memory_report().replace("\n", " | "))
+
     # Solo intentar procesar historial si el canal 'anything' está configurado
     if bot_config.get("channel_anything_id") is not None:
         await process_history_from_last_id()
@@ -456,10 +784,7 @@ async def price(interaction: discord.Interaction, item: str):
     log_action("COMANDO SLASH: PRICE", f"Solicitud del precio de ítem '{item}' por el usuario {interaction.user.name} (ID: {interaction.user.id}).")
     await interaction.response.defer()
     try:
-        log_action("API CALL: PRICE", "Realizando llamada a RuneScape Wiki API para 'mapping'.")
-        mp_response = requests.get("https://prices.runescape.wiki/api/v1/osrs/mapping", headers={'User-Agent':'Discord Bot'})
-        mp_response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-        mp = mp_response.json()
+        mp = await get_item_mapping()
         log_action("API CALL: PRICE", "Mapping data recibida.")
 
         d = next((i for i in mp if i["name"].lower()==item.lower()),None)
@@ -469,13 +794,10 @@ async def price(interaction: discord.Interaction, item: str):
             return
         
         pid = d["id"]
-        log_action("API CALL: PRICE", f"Ítem '{item}' encontrado, ID: {pid}. Realizando llamada a RuneScape Wiki API para 'latest price'.")
-        pd_response = requests.get(f"https://prices.runescape.wiki/api/v1/osrs/latest?id={pid}", headers={'User-Agent':'Discord Bot'})
-        pd_response.raise_for_status()
-        pd = pd_response.json()
+        log_action("API CALL: PRICE", f"Ítem '{item}' encontrado, ID: {pid}.")
+        dat, fetched_at, stale = await wiki_latest_endpoint.get(pid, fetch_latest_price, pid)
         log_action("API CALL: PRICE", f"Datos de precio recibidos para ID: {pid}.")
 
-        dat = pd["data"].get(str(pid),{})
         h = dat.get("high","N/A")
         l = dat.get("low","N/A")
         fmt = lambda x: f"{x:,}" if isinstance(x,int) else x
@@ -488,9 +810,12 @@ async def price(interaction: discord.Interaction, item: str):
                             description=f"🔼 **{hi} gp**\n🔽 **{lo} gp**",
                             color=discord.Color.green())
         emb.set_thumbnail(url=thumb)
-        emb.set_footer(text=f"Última actualización: {datetime.datetime.now():%Y-%m-%d %H:%M:%S}")
+        emb.set_footer(text=build_update_footer(fetched_at, stale))
         await interaction.followup.send(embed=emb)
         log_action("COMANDO SLASH: PRICE", f"Embed de precio para '{item}' enviado exitosamente.")
+    except UpstreamUnavailable as up_e:
+        log_action("ERROR", f"API no disponible al obtener precio para '{item}'", exception_obj=up_e)
+        await interaction.followup.send("❌ La API de precios no está disponible ahora mismo. Por favor, inténtalo de nuevo más tarde.")
     except requests.exceptions.RequestException as req_e:
         log_action("ERROR", f"Error de red/API al obtener precio para '{item}'", exception_obj=req_e)
         await interaction.followup.send("❌ Error de comunicación con la API. Por favor, inténtalo de nuevo más tarde.")
@@ -552,36 +877,342 @@ async def list_aliases(interaction: discord.Interaction):
     log_action("COMANDO SLASH: LISTALIASES", f"Enviando lista de {len(current_alias_map)} alias configurados.")
     await interaction.followup.send(embed=emb)
 
+# ---- RESILIENCIA DE APIS EXTERNAS ----
+
+class UpstreamUnavailable(Exception):
+    """La API externa tiene el circuito abierto y no hay datos en caché que servir."""
+
+def is_upstream_failure(exc):
+    """Los errores 4xx (salvo 429) significan que la API respondió: no cuentan como fallo."""
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        return status >= 500 or status == 429
+    return True
+
+class CircuitBreaker:
+    """Circuito por endpoint: se abre tras varios fallos seguidos y se semiabre con una petición de prueba."""
+    __slots__ = ("name", "failures", "opened_at", "probing")
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow_request(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at < CIRCUIT_RESET_SECONDS or self.probing:
+            return False
+        self.probing = True
+        log_action("CIRCUIT BREAKER", f"Circuito de '{self.name}' semiabierto: enviando petición de prueba.")
+        return True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            log_action("CIRCUIT BREAKER", f"Circuito de '{self.name}' cerrado: la API vuelve a responder.")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            if self.opened_at is None:
+                log_action("CIRCUIT BREAKER", f"Circuito de '{self.name}' abierto tras {self.failures} fallos seguidos.")
+            self.opened_at = time.monotonic()
+
+# ---- PLANIFICADOR DE PETICIONES A APIS EXTERNAS ----
+
+class UpstreamThrottled(UpstreamUnavailable):
+    """La petición superó su tiempo máximo en cola por el presupuesto del host."""
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactiva", PRIORITY_BULK: "masiva", PRIORITY_BACKGROUND: "segundo plano"}
+
+upstream_executors = {
+    priority: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"upstream-{priority}")
+    for priority, workers in UPSTREAM_WORKERS.items()
+}
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class HostScheduler:
+    """Cola con prioridad y token bucket para un host.
+
+    Siempre se despacha primero la petición de mayor prioridad. Las que no son
+    interactivas además dejan UPSTREAM_INTERACTIVE_RESERVE tokens libres, así
+    una consulta interactiva nunca espera detrás de trabajo masivo.
+    """
+
+    def __init__(self, host, rate, capacity):
+        self.host = host
+        self.bucket = TokenBucket(rate, capacity)
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+        self.stats = {p: {"peticiones": 0, "espera_total": 0.0, "espera_max": 0.0, "limitadas": 0} for p in PRIORITY_NAMES}
+
+    async def acquire(self, priority):
+        fut = asyncio.get_running_loop().create_future()
+        enqueued = time.monotonic()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), fut))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        else:
+            self.wakeup.set()
+
+        stats = self.stats[priority]
+        try:
+            await asyncio.wait_for(fut, timeout=UPSTREAM_MAX_QUEUE_SECONDS[priority])
+        except asyncio.TimeoutError:
+            stats["limitadas"] += 1
+            log_action("PLANIFICADOR", f"Petición {PRIORITY_NAMES[priority]} a {self.host} descartada tras {UPSTREAM_MAX_QUEUE_SECONDS[priority]}s en cola.")
+            raise UpstreamThrottled(self.host)
+
+        waited = time.monotonic() - enqueued
+        stats["peticiones"] += 1
+        stats["espera_total"] += waited
+        stats["espera_max"] = max(stats["espera_max"], waited)
+
+    async def _dispatch(self):
+        while self.waiters:
+            priority, _, fut = self.waiters[0]
+            if fut.done():  # Cancelada por superar su tiempo en cola
+                heapq.heappop(self.waiters)
+                continue
+
+            needed = 1 if priority == PRIORITY_INTERACTIVE else 1 + UPSTREAM_INTERACTIVE_RESERVE
+            self.bucket.refill()
+            if self.bucket.tokens >= needed:
+                self.bucket.tokens -= 1
+                heapq.heappop(self.waiters)
+                fut.set_result(None)
+                continue
+
+            # Esperar al siguiente token, o antes si llega una petición más prioritaria
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=(needed - self.bucket.tokens) / self.bucket.rate)
+            except asyncio.TimeoutError:
+                pass
+
+upstream_hosts = {
+    HISCORES_HOST: HostScheduler(HISCORES_HOST, rate=4, capacity=4),
+    WIKI_PRICES_HOST: HostScheduler(WIKI_PRICES_HOST, rate=5, capacity=10),
+}
+
+async def run_upstream(host, priority, func, *args):
+    """Ejecuta una llamada bloqueante a una API externa respetando el presupuesto del host.
+
+    La llamada corre en el pool de hilos de su prioridad, así el trabajo masivo
+    nunca ocupa los hilos que necesitan los comandos interactivos.
+    """
+    await upstream_hosts[host].acquire(priority)
+    return await asyncio.get_running_loop().run_in_executor(upstream_executors[priority], func, *args)
+
+class UpstreamEndpoint:
+    """Caché stale-while-revalidate con circuit breaker para una API externa.
+
+    `get` devuelve (valor, timestamp, caducado). Si el dato está fresco se
+    devuelve sin más; si está caducado se lanza un refresco en segundo plano y
+    se espera como mucho UPSTREAM_STALE_GRACE_SECONDS antes de servir la copia
+    antigua. Sin caché, con el circuito abierto, falla al instante.
+    """
+
+    def __init__(self, name, host, fresh_seconds, cache=None):
+        self.name = name
+        self.host = host
+        self.fresh_seconds = fresh_seconds
+        self.cache = cache if cache is not None else {}
+        self.breaker = CircuitBreaker(name)
+        self.refreshing = {}
+
+    def peek(self, key):
+        """Devuelve el valor si está en caché y fresco, o None."""
+        entry = self.cache.get(key)
+        if entry and time.time() - entry.timestamp < self.fresh_seconds:
+            return entry.value
+        return None
+
+    async def get(self, key, fetch, *args, priority=PRIORITY_INTERACTIVE):
+        """`fetch(*args)` es la función bloqueante que descarga el dato; se ejecuta con run_upstream."""
+        entry = self.cache.get(key)
+        age = time.time() - entry.timestamp if entry else None
+        if entry and age < self.fresh_seconds:
+            return entry.value, entry.timestamp, False
+
+        if entry and age < UPSTREAM_MAX_STALE_SECONDS:
+            task = self._schedule_refresh(key, fetch, args, priority)
+            if task is not None:
+                done, _ = await asyncio.wait({task}, timeout=UPSTREAM_STALE_GRACE_SECONDS)
+                if task in done and task.result():
+                    entry = self.cache[key]
+                    return entry.value, entry.timestamp, False
+            log_action("CACHÉ", f"Sirviendo datos caducados de '{self.name}' para '{key}'.")
+            return entry.value, entry.timestamp, True
+
+        if not self.breaker.allow_request():
+            raise UpstreamUnavailable(self.name)
+        value = await self._fetch(key, fetch, args, priority)
+        return value, self.cache[key].timestamp, False
+
+    async def _fetch(self, key, fetch, args, priority):
+        try:
+            value = await run_upstream(self.host, priority, fetch, *args)
+        except UpstreamThrottled:
+            # No llegó a salir la petición: no dice nada sobre la salud de la API
+            self.breaker.probing = False
+            raise
+        except Exception as e:
+            if is_upstream_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        self.cache[key] = CacheEntry(value, time.time())
+        return value
+
+    def _schedule_refresh(self, key, fetch, args, priority):
+        """Lanza (o reutiliza) el refresco en segundo plano. None si el circuito no lo permite."""
+        task = self.refreshing.get(key)
+        if task is not None:
+            return task
+        if not self.breaker.allow_request():
+            return None
+        task = asyncio.create_task(self._refresh(key, fetch, args, priority))
+        self.refreshing[key] = task
+        return task
+
+    async def _refresh(self, key, fetch, args, priority):
+        try:
+            await self._fetch(key, fetch, args, priority)
+            log_action("CACHÉ", f"Datos de '{self.name}' para '{key}' refrescados.")
+            return True
+        except Exception as e:
+            log_action("ERROR", f"Al refrescar '{self.name}' para '{key}' en segundo plano", exception_obj=e)
+            return False
+        finally:
+            self.refreshing.pop(key, None)
+
+hiscores_personal_endpoint = UpstreamEndpoint("Hiscores (perfil)", HISCORES_HOST, CACHE_EXPIRY_SECONDS, cache=player_hiscores_cache)
+hiscores_lite_endpoint = UpstreamEndpoint("Hiscores (index_lite)", HISCORES_HOST, CACHE_EXPIRY_SECONDS)
+wiki_mapping_endpoint = UpstreamEndpoint("Wiki (mapping)", WIKI_PRICES_HOST, ITEM_MAPPING_EXPIRY_SECONDS)
+wiki_latest_endpoint = UpstreamEndpoint("Wiki (latest)", WIKI_PRICES_HOST, 60)
+
+def build_update_footer(timestamp, stale):
+    """Pie de los embeds con la hora del dato y un aviso si viene de caché caducada."""
+    text = f"Última actualización: {datetime.datetime.fromtimestamp(timestamp):%Y-%m-%d %H:%M:%S}"
+    if stale:
+        text += " · ⚠️ Datos en caché: la API no respondió a tiempo"
+    return text
+
+def fetch_player_rows(username):
+    """Descarga y parsea el perfil personal de Hiscores. Bloqueante."""
+    log_action("API CALL: KC", f"Realizando llamada a Hiscores OSRS para perfil personal de '{username}'.")
+    r = requests.get(
+        HISCORES_PERSONAL_URL.format(username.replace(' ','+')),
+        headers={'User-Agent':'Discord Bot'}, timeout=10
+    )
+    r.raise_for_status()
+    log_action("API CALL: KC", "Perfil personal recibido. Parseando con BeautifulSoup.")
+    # Sólo se guardan las filas: el árbol de BeautifulSoup ocupa mucha más memoria
+    return parse_hiscore_rows(BeautifulSoup(r.text, 'html.parser'))
+
+def fetch_player_lite(username):
+    """Descarga las líneas de index_lite.ws de un jugador. Bloqueante."""
+    log_action("API CALL: LVLS", f"Realizando llamada a Hiscores OSRS para usuario '{username}'.")
+    r = requests.get(HISCORES_LITE_URL.format(username.replace(' ','+')), headers={'User-Agent':'Discord Bot'}, timeout=10)
+    r.raise_for_status()
+    return r.text.splitlines()
+
+def fetch_item_mapping():
+    """Descarga el mapeo de ítems de la wiki. Bloqueante."""
+    log_action("API CALL: MAPPING", "Realizando llamada a RuneScape Wiki API para 'mapping'.")
+    r = requests.get(WIKI_MAPPING_URL, headers={'User-Agent':'Discord Bot'}, timeout=10)
+    r.raise_for_status()
+    return r.json()
+
+def fetch_latest_price(item_id):
+    """Descarga el último precio alto/bajo de un ítem. Bloqueante."""
+    log_action("API CALL: PRICE", f"Realizando llamada a RuneScape Wiki API para 'latest price' del ID {item_id}.")
+    r = requests.get(f"{WIKI_LATEST_URL}?id={item_id}", headers={'User-Agent':'Discord Bot'}, timeout=10)
+    r.raise_for_status()
+    return r.json()["data"].get(str(item_id),{})
+
+async def get_item_mapping():
+    """Devuelve el mapeo de ítems de la wiki desde la caché de la API."""
+    items, _, _ = await wiki_mapping_endpoint.get("mapping", fetch_item_mapping)
+    return items
+
+def parse_hiscore_rows(soup):
+    """Convierte las filas del perfil personal en {nombre: HiscoreRow}."""
+    rows = {}
+    for row in soup.find_all('tr'):
+        cols = row.find_all('td')
+        if len(cols) < 4:
+            continue
+        tag = cols[1].find('a')
+        if not tag:
+            continue
+        img = cols[0].find('img')
+        rows[tag.text.strip()] = HiscoreRow(tuple(c.text.strip() for c in cols[2:]), img['src'] if img else None)
+    return rows
+
+def parse_hiscore_number(text):
+    """Convierte '1,234' en 1234. Devuelve None para valores vacíos o '--'."""
+    try:
+        return int(text.replace(',', ''))
+    except (AttributeError, ValueError):
+        return None
+
+HISCORES_SKILLS = ["Overall","Attack","Defence","Strength","Hitpoints","Ranged",
+                   "Prayer","Magic","Cooking","Woodcutting","Fletching","Fishing",
+                   "Firemaking","Crafting","Smithing","Mining","Herblore","Agility",
+                   "Thieving","Slayer","Farming","Runecraft","Hunter","Construction"]
+
 @tree.command(name="lvls", description="Niveles de una cuenta OSRS.")
 @app_commands.describe(username="Nombre exacto del jugador OSRS.")
 async def lvls(interaction: discord.Interaction, username: str):
     log_action("COMANDO SLASH: LVLS", f"Solicitud de niveles para usuario '{username}' por {interaction.user.name}.")
     await interaction.response.defer()
     try:
-        log_action("API CALL: LVLS", f"Realizando llamada a Hiscores OSRS para usuario '{username}'.")
-        r = requests.get(f"https://secure.runescape.com/m=hiscore_oldschool/index_lite.ws?player={username.replace(' ','+')}")
-        
-        if r.status_code != 200:
-            log_action("COMANDO SLASH: LVLS", f"Perfil '{username}' no encontrado (HTTP Status: {r.status_code}).")
+        try:
+            lines, fetched_at, stale = await hiscores_lite_endpoint.get(username.replace(' ','+'), fetch_player_lite, username)
+        except requests.exceptions.HTTPError as http_e:
+            if is_upstream_failure(http_e):
+                raise
+            log_action("COMANDO SLASH: LVLS", f"Perfil '{username}' no encontrado (HTTP Status: {http_e.response.status_code}).")
             await interaction.followup.send(f"❌ Perfil no encontrado: **{username}**. Asegúrate de escribir el nombre exacto.")
             return
         
-        lines = r.text.splitlines()
-        skills = ["Overall","Attack","Defence","Strength","Hitpoints","Ranged",
-                    "Prayer","Magic","Cooking","Woodcutting","Fletching","Fishing",
-                    "Firemaking","Crafting","Smithing","Mining","Herblore","Agility",
-                    "Thieving","Slayer","Farming","Runecraft","Hunter","Construction"]
-        
         emb = discord.Embed(title=f"📊 Niveles de {username}", color=discord.Color.gold())
-        emb.set_footer(text=f"Última actualización: {datetime.datetime.now():%Y-%m-%d %H:%M:%S}")
+        emb.set_footer(text=build_update_footer(fetched_at, stale))
         
-        for i,sk in enumerate(skills):
+        for i,sk in enumerate(HISCORES_SKILLS):
             lvl = lines[i].split(",")[1] if i < len(lines) else "N/A"
             emb.add_field(name=sk, value=lvl, inline=True)
             log_action("API CALL: LVLS", f"Añadiendo nivel {lvl} para habilidad {sk}.")
         
         await interaction.followup.send(embed=emb)
         log_action("COMANDO SLASH: LVLS", f"Embed de niveles para '{username}' enviado exitosamente.")
+    except UpstreamUnavailable as up_e:
+        log_action("ERROR", f"API no disponible al obtener niveles para '{username}'", exception_obj=up_e)
+        await interaction.followup.send("❌ Hiscores no está disponible ahora mismo. Por favor, inténtalo de nuevo más tarde.")
     except requests.exceptions.RequestException as req_e:
         log_action("ERROR", f"Error de red/API al obtener niveles para '{username}'", exception_obj=req_e)
         await interaction.followup.send("❌ Error de comunicación con la API. Por favor, inténtalo de nuevo más tarde.")
@@ -599,61 +1230,30 @@ async def kc(interaction: discord.Interaction, username: str, boss: str):
     boss_name_to_search = get_alias_map().get(boss_input, boss)
     log_action("COMANDO SLASH: KC", f"Nombre del boss a buscar (considerando alias): '{boss_name_to_search}'.")
 
-    player_url_friendly = username.replace(' ','+')
-    
-    # --- Lógica de caché ---
-    cached_data = player_hiscores_cache.get(player_url_friendly)
-    soup = None
-    if cached_data and (time.time() - cached_data['timestamp']) < CACHE_EXPIRY_SECONDS:
-        soup = cached_data['soup']
-        log_action("CACHÉ KC", f"Usando datos de caché para '{username}'.")
-    else:
-        try:
-            log_action("API CALL: KC", f"Realizando llamada a Hiscores OSRS para perfil personal de '{username}'.")
-            r = requests.get(
-                f"https://secure.runescape.com/m=hiscore_oldschool/hiscorepersonal?user1={player_url_friendly}",
-                headers={'User-Agent':'Discord Bot'}, timeout=10
-            )
-            r.raise_for_status()
-            log_action("API CALL: KC", "Perfil personal recibido. Parseando con BeautifulSoup.")
-            soup = BeautifulSoup(r.text, 'html.parser')
-            
-            # Guardar en caché
-            player_hiscores_cache[player_url_friendly] = {
-                'soup': soup,
-                'timestamp': time.time()
-            }
-            log_action("CACHÉ KC", f"Datos para '{username}' guardados en caché.")
-
-        except requests.exceptions.RequestException as req_e:
-            log_action("ERROR", f"Error de red/API al obtener KC para '{username}'", exception_obj=req_e)
-            await interaction.followup.send("❌ Error de comunicación con la API de RuneScape Hiscores. Por favor, inténtalo de nuevo más tarde.")
-            return
-        except Exception as e:
-            log_action("ERROR", "Al obtener KC", exception_obj=e)
-            await interaction.followup.send("❌ Error al obtener KC. Por favor, inténtalo de nuevo más tarde.")
-            return
+    try:
+        rows, fetched_at, stale = await hiscores_personal_endpoint.get(username.replace(' ','+'), fetch_player_rows, username)
+    except UpstreamUnavailable as up_e:
+        log_action("ERROR", f"API no disponible al obtener KC para '{username}'", exception_obj=up_e)
+        await interaction.followup.send("❌ RuneScape Hiscores no está disponible ahora mismo. Por favor, inténtalo de nuevo más tarde.")
+        return
+    except requests.exceptions.RequestException as req_e:
+        log_action("ERROR", f"Error de red/API al obtener KC para '{username}'", exception_obj=req_e)
+        await interaction.followup.send("❌ Error de comunicación con la API de RuneScape Hiscores. Por favor, inténtalo de nuevo más tarde.")
+        return
+    except Exception as e:
+        log_action("ERROR", "Al obtener KC", exception_obj=e)
+        await interaction.followup.send("❌ Error al obtener KC. Por favor, inténtalo de nuevo más tarde.")
+        return
 
-    if not soup: # Si por alguna razón soup es None después del intento de caché/fetch
+    if not rows: # Si por alguna razón no hay filas después del intento de caché/fetch
         log_action("ERROR", f"No se pudo obtener el HTML para {username} después del intento de caché y fetch.")
         await interaction.followup.send("❌ No se pudo procesar la solicitud. Por favor, inténtalo de nuevo más tarde.")
         return
 
     best, ratio = None, 0
     
-    for row in soup.find_all('tr'):
-        cols = row.find_all('td')
-        if len(cols) < 4:
-            continue
-        
-        tag = cols[1].find('a')
-        kc_td = cols[3] 
-        
-        if not tag or not kc_td:
-            continue
-        
-        name = tag.text.strip()
-        kc_val = kc_td.text.strip()
+    for name, row in rows.items():
+        kc_val = row.values[1]
         sim = fuzz.ratio(boss_name_to_search.lower(), name.lower())
         log_action("SIMILITUD KC", f"Comparando '{boss_name_to_search}' con '{name}'. Similitud: {sim}%.")
         
@@ -661,7 +1261,7 @@ async def kc(interaction: discord.Interaction, username: str, boss: str):
             best, ratio = {
                 'name': name,
                 'kc': kc_val,
-                'img': cols[0].find('img')['src'] if cols[0].find('img') else None
+                'img': row.img
             }, sim
             if sim == 100:
                 log_action("SIMILITUD KC", f"Coincidencia exacta encontrada para '{name}'. Deteniendo búsqueda.")
@@ -680,10 +1280,1190 @@ async def kc(interaction: discord.Interaction, username: str, boss: str):
     )
     if best['img']:
         emb.set_thumbnail(url=best['img'])
-    emb.set_footer(text=f"Última actualización: {datetime.datetime.now():%Y-%m-%d %H:%M:%S}")
+    emb.set_footer(text=build_update_footer(fetched_at, stale))
     await interaction.followup.send(embed=emb)
     log_action("COMANDO SLASH: KC", f"Embed de KC para '{username}' enviado exitosamente.")
 
+# ---- LEADERBOARD DEL CLAN ----
+
+async def fetch_member_rows(username, semaphore):
+    """Obtiene las filas de Hiscores de un miembro. Devuelve (username, filas o None)."""
+    try:
+        async with semaphore:
+            rows, _, _ = await hiscores_personal_endpoint.get(username.replace(' ','+'), fetch_player_rows, username, priority=PRIORITY_BULK)
+        return username, rows
+    except Exception as e:
+        log_action("ERROR", f"Al obtener Hiscores de '{username}' para el leaderboard", exception_obj=e)
+        return username, None
+
+def leaderboard_candidates(tipo, rows):
+    """Nombres de las filas válidos para el tipo pedido: habilidades para "skill" y el resto para "boss"."""
+    if tipo == "skill":
+        return {name for name in rows if name in HISCORES_SKILLS}
+    return {name for name in rows if name not in HISCORES_SKILLS}
+
+def find_exact_hiscore_name(candidates, search_name):
+    """Coincidencia exacta (sin distinguir mayúsculas) del nombre buscado o de su alias."""
+    search_lower = search_name.lower()
+    for name in candidates:
+        if name.lower() == search_lower:
+            return name
+    return None
+
+def resolve_hiscore_name(candidates, search_name):
+    """Busca el nombre de habilidad/boss: primero exacto y si no por similitud. Devuelve None si no hay coincidencia."""
+    exact = find_exact_hiscore_name(candidates, search_name)
+    if exact:
+        return exact
+    best, ratio = None, 0
+    for name in sorted(candidates):
+        sim = fuzz.ratio(search_name.lower(), name.lower())
+        if sim > ratio:
+            best, ratio = name, sim
+    return best if ratio >= 70 else None
+
+def build_leaderboard_entry(tipo, username, row):
+    """Devuelve (valor para ordenar, username, texto) o None si el jugador no tiene datos."""
+    if row is None:
+        return None
+    values = row.values
+    if tipo == "skill":
+        level = parse_hiscore_number(values[1]) if len(values) > 1 else None
+        xp = parse_hiscore_number(values[2]) if len(values) > 2 else None
+        if xp is None:
+            return None
+        return xp, username, f"Nivel {level} ({xp:,} xp)"
+    kills = parse_hiscore_number(values[1]) if len(values) > 1 else None
+    if kills is None:
+        return None
+    return kills, username, f"{kills:,} kills"
+
+def build_leaderboard_embed(title, entries, page, done, total, failed):
+    total_pages = max(1, -(-len(entries) // LEADERBOARD_PAGE_SIZE))
+    start = page * LEADERBOARD_PAGE_SIZE
+    lines = [f"**{start + i + 1}.** {name} — {text}" for i, (_, name, text) in enumerate(entries[start:start + LEADERBOARD_PAGE_SIZE])]
+    emb = discord.Embed(title=title, description="\n".join(lines) or "Sin resultados todavía.", color=discord.Color.purple())
+    footer = f"Página {page + 1}/{total_pages} · {done}/{total} miembros consultados"
+    if failed:
+        footer += f" · {failed} sin datos"
+    emb.set_footer(text=footer)
+    return emb
+
+class LeaderboardView(discord.ui.View):
+    """Botones para paginar un leaderboard ya completo."""
+
+    def __init__(self, title, entries, total, failed):
+        super().__init__(timeout=300)
+        self.title = title
+        self.entries = entries
+        self.total = total
+        self.failed = failed
+        self.page = 0
+
+    def total_pages(self):
+        return max(1, -(-len(self.entries) // LEADERBOARD_PAGE_SIZE))
+
+    def build_embed(self):
+        return build_leaderboard_embed(self.title, self.entries, self.page, self.total, self.total, self.failed)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = (self.page - 1) % self.total_pages()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = (self.page + 1) % self.total_pages()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+@tree.command(name="leaderboard", description="Ranking del clan por habilidad o boss.")
+@app_commands.describe(tipo="Habilidad o boss.", nombre="Nombre de la habilidad o del boss (admite alias).")
+@app_commands.choices(tipo=[
+    app_commands.Choice(name="Habilidad", value="skill"),
+    app_commands.Choice(name="Boss", value="boss")
+])
+async def leaderboard(interaction: discord.Interaction, tipo: app_commands.Choice[str], nombre: str):
+    log_action("COMANDO SLASH: LEADERBOARD", f"Solicitud de leaderboard de {tipo.value} '{nombre}' por {interaction.user.name}.")
+    await interaction.response.defer()
+
+    members = list(get_clan_members())
+    if not members:
+        log_action("COMANDO SLASH: LEADERBOARD", "No hay miembros del clan configurados.")
+        await interaction.followup.send("❌ No hay miembros del clan configurados. Añádelos con `/addmiembro`.")
+        return
+
+    name_to_search = get_alias_map().get(nombre.lower(), nombre)
+    title = f"🏆 Leaderboard del clan: {name_to_search}"
+    entries, done, failed = [], 0, 0
+    # Las habilidades son fijas; los bosses se buscan en la unión de las filas de todos
+    # los miembros, porque el perfil personal omite las actividades sin rango.
+    candidates = set(HISCORES_SKILLS) if tipo.value == "skill" else set()
+    resolved_name = find_exact_hiscore_name(candidates, name_to_search) or (resolve_hiscore_name(candidates, name_to_search) if candidates else None)
+    if resolved_name:
+        title = f"🏆 Leaderboard del clan: {resolved_name}"
+    pending = []  # Miembros consultados antes de saber qué fila usar
+
+    def add_entry(username, rows):
+        entry = build_leaderboard_entry(tipo.value, username, rows.get(resolved_name) if rows else None)
+        if entry:
+            entries.append(entry)
+            entries.sort(key=lambda e: e[0], reverse=True)
+            return 0
+        return 1
+
+    msg = await interaction.followup.send(embed=build_leaderboard_embed(title, entries, 0, done, len(members), failed), wait=True)
+
+    semaphore = asyncio.Semaphore(LEADERBOARD_CONCURRENCY)
+    fetches = [asyncio.create_task(fetch_member_rows(m, semaphore)) for m in members]
+    for fut in asyncio.as_completed(fetches):
+        username, rows = await fut
+        done += 1
+        if resolved_name is None:
+            pending.append((username, rows))
+            if rows:
+                candidates |= leaderboard_candidates(tipo.value, rows)
+                # Sólo una coincidencia exacta es segura antes de tener todas las filas
+                resolved_name = find_exact_hiscore_name(candidates, name_to_search)
+            if resolved_name:
+                title = f"🏆 Leaderboard del clan: {resolved_name}"
+                for pending_username, pending_rows in pending:
+                    failed += add_entry(pending_username, pending_rows)
+                pending = []
+        else:
+            failed += add_entry(username, rows)
+
+        # Mostrar resultados parciales cada vez que se completa una página de miembros
+        if done % LEADERBOARD_PAGE_SIZE == 0 and done < len(members):
+            try:
+                await msg.edit(embed=build_leaderboard_embed(title, entries, 0, done, len(members), failed))
+            except discord.HTTPException as e:
+                log_action("ERROR", "Al actualizar el leaderboard parcial", exception_obj=e)
+
+    if resolved_name is None:
+        resolved_name = resolve_hiscore_name(candidates, name_to_search)
+        if resolved_name is None:
+            log_action("COMANDO SLASH: LEADERBOARD", f"No se encontró {tipo.name.lower()} '{nombre}' en los Hiscores de los miembros del clan.")
+            await msg.edit(content=f"❌ No se encontró {'la habilidad' if tipo.value == 'skill' else 'el boss'} '{nombre}'. Intenta un nombre más exacto o revisa el tipo elegido.", embed=None)
+            return
+        title = f"🏆 Leaderboard del clan: {resolved_name}"
+        for pending_username, pending_rows in pending:
+            failed += add_entry(pending_username, pending_rows)
+
+    view = LeaderboardView(title, entries, len(members), failed)
+    await msg.edit(embed=view.build_embed(), view=view)
+    log_action("COMANDO SLASH: LEADERBOARD", f"Leaderboard de '{resolved_name}' enviado con {len(entries)} jugadores ({failed} sin datos).")
+
+@tree.command(name="addmiembro", description="Añade un jugador a la lista de miembros del clan.")
+@app_commands.describe(username="Nombre exacto del jugador OSRS.")
+@app_commands.default_permissions(manage_guild=True)
+async def add_member(interaction: discord.Interaction, username: str):
+    log_action("COMANDO SLASH: ADDMIEMBRO", f"Solicitud para añadir miembro '{username}' por {interaction.user.name}.")
+    await interaction.response.defer(ephemeral=True)
+    members = get_clan_members()
+    if username.lower() in (m.lower() for m in members):
+        await interaction.followup.send(f"❌ `{username}` ya está en la lista del clan.", ephemeral=True)
+        return
+    members.append(username)
+    set_clan_members(members)
+    log_action("COMANDO SLASH: ADDMIEMBRO", f"Miembro '{username}' añadido. Total: {len(members)}.")
+    await interaction.followup.send(f"✅ `{username}` añadido al clan ({len(members)} miembros).", ephemeral=True)
+
+@tree.command(name="delmiembro", description="Quita un jugador de la lista de miembros del clan.")
+@app_commands.describe(username="Nombre del jugador a quitar.")
+@app_commands.default_permissions(manage_guild=True)
+async def delete_member(interaction: discord.Interaction, username: str):
+    log_action("COMANDO SLASH: DELMIEMBRO", f"Solicitud para quitar miembro '{username}' por {interaction.user.name}.")
+    await interaction.response.defer(ephemeral=True)
+    members = get_clan_members()
+    remaining = [m for m in members if m.lower() != username.lower()]
+    if len(remaining) == len(members):
+        await interaction.followup.send(f"❌ `{username}` no está en la lista del clan.", ephemeral=True)
+        return
+    set_clan_members(remaining)
+    log_action("COMANDO SLASH: DELMIEMBRO", f"Miembro '{username}' quitado. Total: {len(remaining)}.")
+    await interaction.followup.send(f"✅ `{username}` quitado del clan ({len(remaining)} miembros).", ephemeral=True)
+
+# ---- HISTORIAL DE PRECIOS ----
+
+# Niveles de resolución: (nombre, segundos entre muestras, segundos de retención).
+# Cada muestra se añade a "raw" y, por diezmado, a los niveles más gruesos cuando
+# ha pasado su intervalo, así los rangos largos no tienen que leer datos crudos.
+PRICE_HISTORY_TIERS = [
+    ("raw", 0, 2 * 86400),
+    ("1h", 3600, 8 * 86400),
+    ("4h", 4 * 3600, 31 * 86400),
+]
+PRICE_HISTORY_RANGES = {"1d": (86400, "raw"), "7d": (7 * 86400, "1h"), "30d": (30 * 86400, "4h")}
+PRICE_HISTORY_COLUMNS = {"ts": np.int64, "item": np.int32, "high": np.int32, "low": np.int32}
+
+class PriceHistoryStore:
+    """Historial de precios en archivos columnares de ancho fijo leídos con np.memmap.
+
+    Cada nivel guarda una fila por (muestra, ítem) repartida en un archivo por
+    columna. Añadir es O(1) (append al final de cada archivo) y las consultas
+    sólo tocan las páginas del rango pedido gracias a la búsqueda binaria sobre
+    la columna de timestamps, que está ordenada.
+
+    El recolector y /pricehistory usan el almacén desde hilos distintos, así que
+    append (con su compactación) y query se serializan con un lock: una consulta
+    nunca ve las columnas a medio escribir ni archivos reemplazados a mitad.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.last_ts = {}
+        for tier, _, _ in PRICE_HISTORY_TIERS:
+            self._repair(tier)
+            ts = self._open(tier, "ts")
+            self.last_ts[tier] = int(ts[-1]) if len(ts) else 0
+
+    def _path(self, tier, column):
+        return os.path.join(self.directory, f"{tier}.{column}")
+
+    def _open(self, tier, column):
+        path = self._path(tier, column)
+        dtype = PRICE_HISTORY_COLUMNS[column]
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def _rows(self, tier, column):
+        path = self._path(tier, column)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        return size // np.dtype(PRICE_HISTORY_COLUMNS[column]).itemsize
+
+    def _repair(self, tier):
+        """Recorta las columnas al mismo número de filas por si un append quedó a medias."""
+        rows = min(self._rows(tier, column) for column in PRICE_HISTORY_COLUMNS)
+        for column, dtype in PRICE_HISTORY_COLUMNS.items():
+            path = self._path(tier, column)
+            size = rows * np.dtype(dtype).itemsize
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+                log_action("HISTORIAL PRECIOS", f"Columna {tier}.{column} recortada a {rows} filas.")
+
+    def append(self, timestamp, item_ids, highs, lows):
+        """Añade una muestra completa (todos los ítems) a los niveles que correspondan."""
+        count = len(item_ids)
+        columns = {
+            "ts": np.full(count, timestamp, dtype=np.int64),
+            "item": np.asarray(item_ids, dtype=np.int32),
+            "high": np.asarray(highs, dtype=np.int32),
+            "low": np.asarray(lows, dtype=np.int32),
+        }
+        with self.lock:
+            for tier, interval, retention in PRICE_HISTORY_TIERS:
+                if self.last_ts[tier] and timestamp - self.last_ts[tier] < interval:
+                    continue
+                for column, values in columns.items():
+                    with open(self._path(tier, column), "ab") as f:
+                        f.write(values.tobytes())
+                self.last_ts[tier] = timestamp
+                self._compact_if_needed(tier, timestamp - retention)
+
+    def _compact_if_needed(self, tier, cutoff):
+        """Elimina filas más antiguas que la retención cuando ya son al menos un cuarto del archivo.
+
+        Se llama con self.lock adquirido.
+        """
+        ts = self._open(tier, "ts")
+        if not len(ts) or ts[0] >= cutoff:
+            return
+        start = int(np.searchsorted(ts, cutoff, side="left"))
+        total = len(ts)
+        del ts  # Liberar el mapeo antes de reemplazar el archivo (necesario en Windows)
+        if start * 4 < total:
+            return
+        for column in PRICE_HISTORY_COLUMNS:
+            data = self._open(tier, column)
+            tmp_path = self._path(tier, column) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(np.ascontiguousarray(data[start:]).tobytes())
+            del data
+            os.replace(tmp_path, self._path(tier, column))
+        log_action("HISTORIAL PRECIOS", f"Nivel '{tier}' compactado: {start} filas antiguas eliminadas.")
+
+    def query(self, tier, item_id, since):
+        """Devuelve (timestamps, highs, lows) de un ítem desde `since`, sin cargar todo el archivo."""
+        with self.lock:
+            ts = self._open(tier, "ts")
+            start = int(np.searchsorted(ts, since, side="left"))
+            items = self._open(tier, "item")[start:]
+            mask = items == item_id
+            # La indexación booleana copia los datos, así que no quedan mapeos abiertos al soltar el lock
+            return (
+                np.asarray(ts[start:][mask]),
+                np.asarray(self._open(tier, "high")[start:][mask]),
+                np.asarray(self._open(tier, "low")[start:][mask]),
+            )
+
+price_history_store = None
+price_history_store_lock = threading.Lock()
+
+def get_price_history_store():
+    global price_history_store
+    with price_history_store_lock:  # Se llama desde hilos de trabajo
+        if price_history_store is None:
+            price_history_store = PriceHistoryStore(resource_path(PRICE_HISTORY_DIR))
+    return price_history_store
+
+def sample_prices():
+    """Descarga la tabla completa de precios y la añade al historial. Bloqueante.
+
+    Devuelve los arreglos (item_ids, highs, lows) para reutilizarlos en las alertas.
+    """
+    r = requests.get(WIKI_LATEST_URL, headers={'User-Agent':'Discord Bot'}, timeout=15)
+    r.raise_for_status()
+    data = r.json()["data"]
+    item_ids = np.fromiter((int(k) for k in data), dtype=np.int32, count=len(data))
+    highs = np.fromiter((v.get("high") or 0 for v in data.values()), dtype=np.int64, count=len(data))
+    lows = np.fromiter((v.get("low") or 0 for v in data.values()), dtype=np.int64, count=len(data))
+    # El precio máximo en OSRS es 2.147.483.647 gp, así que saturar a int32 no pierde datos reales
+    int32_max = np.iinfo(np.int32).max
+    highs = np.minimum(highs, int32_max)
+    lows = np.minimum(lows, int32_max)
+    get_price_history_store().append(int(time.time()), item_ids, highs, lows)
+    return item_ids, highs, lows
+
+@tasks.loop(minutes=PRICE_HISTORY_INTERVAL_MINUTES)
+async def price_history_collector():
+    try:
+        item_ids, highs, lows = await run_upstream(WIKI_PRICES_HOST, PRIORITY_BACKGROUND, sample_prices)
+        log_action("HISTORIAL PRECIOS", f"Muestra de precios guardada ({len(item_ids)} ítems).")
+    except Exception as e:
+        log_action("ERROR", "Al muestrear precios para el historial", exception_obj=e)
+        return
+
+    try:
+        fired, state_changed = price_alert_engine.evaluate(item_ids, highs, lows, time.time())
+        if state_changed:
+            log_action("ALERTAS PRECIO", "Guardando el estado de las alertas (armadas/último aviso).")
+            save_config()
+        if len(fired):
+            await send_price_alert_notifications(fired, item_ids, highs, lows)
+    except Exception as e:
+        log_action("ERROR", "Al evaluar alertas de precio", exception_obj=e)
+
+def summarize_price_history(timestamps, highs, lows):
+    """Calcula min/max/promedio/volatilidad del precio medio ignorando muestras sin datos."""
+    valid = (highs > 0) & (lows > 0)
+    if not valid.any():
+        return None
+    high = highs[valid].astype(np.float64)
+    low = lows[valid].astype(np.float64)
+    mid = (high + low) / 2
+    returns = np.diff(np.log(mid))
+    return {
+        "samples": int(valid.sum()),
+        "min": int(low.min()),
+        "max": int(high.max()),
+        "avg": int(mid.mean()),
+        "volatility": float(returns.std() * 100) if len(returns) else 0.0,
+        "first_ts": int(timestamps[valid][0]),
+    }
+
+@tree.command(name="pricehistory", description="Historial de precio de un ítem OSRS.")
+@app_commands.describe(item="Nombre del ítem.", rango="Rango de tiempo.")
+@app_commands.rename(rango="range")
+@app_commands.choices(rango=[app_commands.Choice(name=r, value=r) for r in PRICE_HISTORY_RANGES])
+async def pricehistory(interaction: discord.Interaction, item: str, rango: app_commands.Choice[str]):
+    log_action("COMANDO SLASH: PRICEHISTORY", f"Solicitud de historial de '{item}' ({rango.value}) por {interaction.user.name}.")
+    await interaction.response.defer()
+    try:
+        mp = await get_item_mapping()
+        d = next((i for i in mp if i["name"].lower()==item.lower()),None)
+        if not d:
+            log_action("COMANDO SLASH: PRICEHISTORY", f"Ítem '{item}' no encontrado en el mapeo de la API.")
+            await interaction.followup.send(f"❌ Ítem no encontrado: **{item}**")
+            return
+
+        seconds, tier = PRICE_HISTORY_RANGES[rango.value]
+        timestamps, highs, lows = await asyncio.to_thread(get_price_history_store().query, tier, d["id"], int(time.time()) - seconds)
+        stats = summarize_price_history(timestamps, highs, lows)
+        if not stats:
+            log_action("COMANDO SLASH: PRICEHISTORY", f"Sin historial para '{d['name']}' en {rango.value}.")
+            await interaction.followup.send(f"❌ Todavía no hay historial para **{d['name']}** en el rango {rango.value}.")
+            return
+
+        emb = discord.Embed(title=f"📈 {d['name']} ({rango.value})", color=discord.Color.green())
+        emb.add_field(name="Mínimo", value=f"{stats['min']:,} gp", inline=True)
+        emb.add_field(name="Máximo", value=f"{stats['max']:,} gp", inline=True)
+        emb.add_field(name="Promedio", value=f"{stats['avg']:,} gp", inline=True)
+        emb.add_field(name="Volatilidad", value=f"{stats['volatility']:.2f}% por muestra", inline=True)
+        emb.set_thumbnail(url=f"https://oldschool.runescape.wiki/images/{d['name'].replace(' ','_')}.png")
+        emb.set_footer(text=f"{stats['samples']} muestras desde {datetime.datetime.fromtimestamp(stats['first_ts']):%Y-%m-%d %H:%M}")
+        await interaction.followup.send(embed=emb)
+        log_action("COMANDO SLASH: PRICEHISTORY", f"Historial de '{d['name']}' enviado ({stats['samples']} muestras).")
+    except UpstreamUnavailable as up_e:
+        log_action("ERROR", f"API no disponible al obtener historial para '{item}'", exception_obj=up_e)
+        await interaction.followup.send("❌ La API de precios no está disponible ahora mismo. Por favor, inténtalo de nuevo más tarde.")
+    except requests.exceptions.RequestException as req_e:
+        log_action("ERROR", f"Error de red/API al obtener historial para '{item}'", exception_obj=req_e)
+        await interaction.followup.send("❌ Error de comunicación con la API. Por favor, inténtalo de nuevo más tarde.")
+    except Exception as e:
+        log_action("ERROR", "Al obtener historial de precios", exception_obj=e)
+        await interaction.followup.send("❌ Error al obtener el historial de precios. Por favor, inténtalo de nuevo más tarde.")
+
+# ---- ALERTAS DE PRECIO ----
+
+class PriceAlertEngine:
+    """Alertas de precio en arreglos paralelos para evaluarlas todas de una vez.
+
+    Cada alerta ocupa la misma posición en todos los arreglos. La dirección es 1
+    ("sube por encima", compara con el precio alto) o -1 ("baja de", compara con
+    el precio bajo). Una alerta disparada queda desarmada hasta que el precio
+    retrocede PRICE_ALERT_HYSTERESIS más allá del umbral, y además respeta un
+    cooldown entre avisos. Ese estado se copia a los dicts de las alertas
+    ("armed", "last_fired") para que sobreviva a un reinicio.
+
+    Los dicts son los mismos que los de bot_config["price_alerts"]: cada vez que
+    esa lista cambia se vuelve a llamar a load() con ella.
+    """
+
+    def __init__(self):
+        self.alerts = []
+        self.load([])
+
+    @staticmethod
+    def _key(alert):
+        return (alert["item_id"], alert["threshold"], alert["direction"], alert["channel_id"], alert["user_id"])
+
+    def load(self, alerts):
+        """Carga las alertas conservando el estado más reciente de las que ya estaban cargadas."""
+        previous = {self._key(a): a for a in self.alerts}
+        for alert in alerts:
+            old = previous.get(self._key(alert))
+            if old is not None and old is not alert and old.get("last_fired", 0.0) >= alert.get("last_fired", 0.0):
+                alert["armed"] = old.get("armed", True)
+                alert["last_fired"] = old.get("last_fired", 0.0)
+        self.alerts = list(alerts)
+        self.item_ids = np.array([a["item_id"] for a in alerts], dtype=np.int32)
+        self.thresholds = np.array([a["threshold"] for a in alerts], dtype=np.int64)
+        self.directions = np.array([a["direction"] for a in alerts], dtype=np.int8)
+        self.channel_ids = np.array([a["channel_id"] for a in alerts], dtype=np.int64)
+        self.armed = np.array([a.get("armed", True) for a in alerts], dtype=bool)
+        self.last_fired = np.array([a.get("last_fired", 0.0) for a in alerts], dtype=np.float64)
+
+    def evaluate(self, item_ids, highs, lows, now):
+        """Compara todas las alertas con una foto de precios.
+
+        Devuelve (índices disparados, True si cambió el estado de alguna alerta y hay que guardarlo).
+        """
+        if not len(self.alerts) or not len(item_ids):
+            return np.empty(0, dtype=np.intp), False
+
+        # Tablas densas id -> precio para indexar todas las alertas de golpe
+        size = int(max(item_ids.max(), self.item_ids.max())) + 1
+        high_by_id = np.zeros(size, dtype=np.int64)
+        low_by_id = np.zeros(size, dtype=np.int64)
+        high_by_id[item_ids] = highs
+        low_by_id[item_ids] = lows
+
+        prices = np.where(self.directions > 0, high_by_id[self.item_ids], low_by_id[self.item_ids])
+        distance = self.directions * (prices - self.thresholds)
+        has_price = prices > 0
+
+        crossed = has_price & (distance >= 0)
+        rearm = has_price & (distance < -PRICE_ALERT_HYSTERESIS * self.thresholds)
+        fired = crossed & self.armed & (now - self.last_fired >= PRICE_ALERT_COOLDOWN_SECONDS)
+
+        changed = fired | (rearm & ~self.armed)
+        self.armed[rearm] = True
+        self.armed[fired] = False
+        self.last_fired[fired] = now
+        for idx in np.flatnonzero(changed).tolist():
+            self.alerts[idx]["armed"] = bool(self.armed[idx])
+            self.alerts[idx]["last_fired"] = float(self.last_fired[idx])
+        return np.flatnonzero(fired), bool(changed.any())
+
+price_alert_engine = PriceAlertEngine()
+
+async def send_price_alert_notifications(fired, item_ids, highs, lows):
+    """Envía un único mensaje por canal con todas las alertas disparadas en él."""
+    price_by_id = dict(zip(item_ids.tolist(), zip(highs.tolist(), lows.tolist())))
+    # Copiar las alertas antes del primer await: /delalerta_precio puede reordenar el motor mientras se envía
+    channels, inverse = np.unique(price_alert_engine.channel_ids[fired], return_inverse=True)
+    alerts_by_channel = [
+        (channel_id, [price_alert_engine.alerts[idx] for idx in fired[inverse == pos].tolist()])
+        for pos, channel_id in enumerate(channels.tolist())
+    ]
+    for channel_id, channel_alerts in alerts_by_channel:
+        ch = bot.get_channel(channel_id)
+        if not ch:
+            log_action("ERROR", f"Canal ID {channel_id} de alertas de precio no encontrado.")
+            continue
+
+        lines = []
+        for alert in channel_alerts:
+            high, low = price_by_id.get(alert["item_id"], (0, 0))
+            if alert["direction"] > 0:
+                lines.append(f"<@{alert['user_id']}> 🔼 **{alert['item_name']}** subió a {high:,} gp (umbral {alert['threshold']:,} gp)")
+            else:
+                lines.append(f"<@{alert['user_id']}> 🔽 **{alert['item_name']}** bajó a {low:,} gp (umbral {alert['threshold']:,} gp)")
+
+        # Agrupar líneas en mensajes que respeten el límite de 2000 caracteres de Discord
+        chunk = ""
+        try:
+            for line in lines:
+                if len(chunk) + len(line) + 1 > 2000:
+                    await ch.send(chunk)
+                    chunk = ""
+                chunk += line + "\n"
+            if chunk:
+                await ch.send(chunk)
+            log_action("ALERTAS PRECIO", f"{len(lines)} alertas enviadas a {ch.name}.")
+        except Exception as e:
+            log_action("ERROR", f"Al enviar alertas de precio a {ch.name}", exception_obj=e)
+
+@tree.command(name="alerta_precio", description="Avisa en este canal cuando un ítem cruce un precio.")
+@app_commands.describe(item="Nombre del ítem.", direccion="Avisar cuando suba por encima o baje del umbral.", umbral="Precio umbral en gp.")
+@app_commands.choices(direccion=[
+    app_commands.Choice(name="Sube por encima de", value=1),
+    app_commands.Choice(name="Baja de", value=-1)
+])
+async def alerta_precio(interaction: discord.Interaction, item: str, direccion: app_commands.Choice[int], umbral: app_commands.Range[int, 1]):
+    log_action("COMANDO SLASH: ALERTA_PRECIO", f"Solicitud de alerta '{item}' {direccion.name} {umbral} por {interaction.user.name}.")
+    await interaction.response.defer(ephemeral=True)
+    try:
+        mp = await get_item_mapping()
+    except UpstreamUnavailable as up_e:
+        log_action("ERROR", f"API no disponible al crear alerta para '{item}'", exception_obj=up_e)
+        await interaction.followup.send("❌ La API de precios no está disponible ahora mismo. Por favor, inténtalo de nuevo más tarde.", ephemeral=True)
+        return
+    except requests.exceptions.RequestException as req_e:
+        log_action("ERROR", f"Error de red/API al crear alerta para '{item}'", exception_obj=req_e)
+        await interaction.followup.send("❌ Error de comunicación con la API. Por favor, inténtalo de nuevo más tarde.", ephemeral=True)
+        return
+    except Exception as e:
+        log_action("ERROR", "Al obtener el mapeo de ítems para la alerta", exception_obj=e)
+        await interaction.followup.send("❌ Error al crear la alerta. Por favor, inténtalo de nuevo más tarde.", ephemeral=True)
+        return
+
+    d = next((i for i in mp if i["name"].lower()==item.lower()),None)
+    if not d:
+        log_action("COMANDO SLASH: ALERTA_PRECIO", f"Ítem '{item}' no encontrado en el mapeo de la API.")
+        await interaction.followup.send(f"❌ Ítem no encontrado: **{item}**", ephemeral=True)
+        return
+
+    alert = {
+        "item_id": d["id"],
+        "item_name": d["name"],
+        "threshold": umbral,
+        "direction": direccion.value,
+        "channel_id": interaction.channel_id,
+        "user_id": interaction.user.id
+    }
+    alerts = get_price_alerts()
+    alerts.append(alert)
+    set_price_alerts(alerts)
+    price_alert_engine.load(alerts)
+    log_action("COMANDO SLASH: ALERTA_PRECIO", f"Alerta creada para '{d['name']}' ({direccion.name} {umbral:,} gp). Total: {len(alerts)}.")
+    await interaction.followup.send(f"✅ Te avisaré aquí cuando **{d['name']}** {direccion.name.lower()} **{umbral:,} gp**.", ephemeral=True)
+
+@tree.command(name="delalerta_precio", description="Borra tus alertas de precio de un ítem.")
+@app_commands.describe(item="Nombre del ítem.")
+async def delalerta_precio(interaction: discord.Interaction, item: str):
+    log_action("COMANDO SLASH: DELALERTA_PRECIO", f"Solicitud para borrar alertas de '{item}' por {interaction.user.name}.")
+    await interaction.response.defer(ephemeral=True)
+    alerts = get_price_alerts()
+    remaining = [a for a in alerts if not (a["user_id"] == interaction.user.id and a["item_name"].lower() == item.lower())]
+    removed = len(alerts) - len(remaining)
+    if not removed:
+        await interaction.followup.send(f"❌ No tienes alertas para **{item}**.", ephemeral=True)
+        return
+
+    set_price_alerts(remaining)
+    price_alert_engine.load(remaining)
+    log_action("COMANDO SLASH: DELALERTA_PRECIO", f"{removed} alertas de '{item}' borradas.")
+    await interaction.followup.send(f"✅ {removed} alerta(s) de **{item}** borradas.", ephemeral=True)
+
+# ---- SEGUIMIENTO DE GANANCIAS DEL CLAN ----
+
+GAINS_RECORD_HEADER = struct.Struct("<qBI")  # timestamp, tipo (0 = keyframe, 1 = delta), nº de valores
+GAINS_KEYFRAME = 0
+GAINS_DELTA = 1
+
+class GainsIndex:
+    """Índice en memoria de un archivo de snapshots, en arrays compactos (8 bytes por entrada).
+
+    `timestamps` y `offsets` tienen una entrada por snapshot; `keyframes` guarda
+    las posiciones de los keyframes para encontrar de cuál depende cada delta.
+    """
+    __slots__ = ("timestamps", "offsets", "keyframes")
+
+    def __init__(self):
+        self.timestamps = array("q")
+        self.offsets = array("q")
+        self.keyframes = array("q")
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def add(self, timestamp, offset, is_keyframe):
+        if is_keyframe:
+            self.keyframes.append(len(self.timestamps))
+        self.timestamps.append(timestamp)
+        self.offsets.append(offset)
+
+    def keyframe_for(self, position):
+        return self.keyframes[bisect.bisect_right(self.keyframes, position) - 1]
+
+def gains_player_key(username):
+    """Clave del jugador para archivos y cachés: los nombres de OSRS no distinguen mayúsculas ni espacios/guiones bajos."""
+    return re.sub(r"[^a-z0-9_-]", "_", username.lower().replace(" ", "_"))
+
+class GainsStore:
+    """Snapshots de Hiscores por jugador con codificación delta y keyframes periódicos.
+
+    Cada jugador tiene un archivo binario de sólo-append. Un keyframe guarda el
+    vector completo de valores; un delta sólo los índices y valores que
+    cambiaron desde el snapshot anterior. Cada GAINS_KEYFRAME_INTERVAL snapshots
+    se escribe un keyframe, así reconstruir cualquier punto lee como mucho un
+    keyframe y los deltas que lo siguen. Las columnas ("Attack|xp",
+    "Vorkath|score", ...) se registran en columns.json y nunca cambian de índice.
+
+    Para añadir sólo hace falta el último vector de cada jugador; los índices
+    completos se cargan al consultar y se guardan en una caché LRU limitada a
+    GAINS_INDEX_CACHE_SIZE jugadores. Los métodos públicos hacen E/S de disco y
+    se llaman desde hilos de trabajo, así que se serializan con un lock.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.columns_path = os.path.join(directory, "columns.json")
+        self.columns = []
+        if os.path.exists(self.columns_path):
+            with open(self.columns_path, "r", encoding="utf-8") as f:
+                self.columns = json.load(f)
+        self.column_index = {name: i for i, name in enumerate(self.columns)}
+        self.indexes = OrderedDict()
+        self.last_vectors = {}
+        self.since_keyframe = {}
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _load_index(self, key):
+        """Lee sólo las cabeceras del archivo y construye su índice. None si no hay snapshots."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        index = GainsIndex()
+        with open(path, "rb") as f:
+            while True:
+                offset = f.tell()
+                header = f.read(GAINS_RECORD_HEADER.size)
+                if len(header) < GAINS_RECORD_HEADER.size:
+                    break
+                timestamp, kind, count = GAINS_RECORD_HEADER.unpack(header)
+                payload = count * 8 if kind == GAINS_KEYFRAME else count * 12
+                if len(f.read(payload)) < payload:
+                    break  # Registro incompleto al final (escritura interrumpida)
+                index.add(timestamp, offset, kind == GAINS_KEYFRAME)
+        if os.path.getsize(path) != offset:
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        return index if len(index) else None
+
+    def _index(self, key):
+        """Índice del jugador desde la caché LRU. No se guardan jugadores sin snapshots."""
+        index = self.indexes.get(key)
+        if index is not None:
+            self.indexes.move_to_end(key)
+            return index
+        index = self._load_index(key)
+        if index is not None:
+            self.indexes[key] = index
+            if len(self.indexes) > GAINS_INDEX_CACHE_SIZE:
+                self.indexes.popitem(last=False)
+        return index
+
+    def _read_vector(self, key, index, position):
+        """Reconstruye el vector del snapshot en `position`: su keyframe más los deltas siguientes."""
+        keyframe = index.keyframe_for(position)
+        with open(self._path(key), "rb") as f:
+            f.seek(index.offsets[keyframe])
+            _, _, count = GAINS_RECORD_HEADER.unpack(f.read(GAINS_RECORD_HEADER.size))
+            vector = np.frombuffer(f.read(count * 8), dtype=np.int64).copy()
+            for pos in range(keyframe + 1, position + 1):
+                f.seek(index.offsets[pos])
+                _, _, count = GAINS_RECORD_HEADER.unpack(f.read(GAINS_RECORD_HEADER.size))
+                positions = np.frombuffer(f.read(count * 4), dtype=np.uint32)
+                values = np.frombuffer(f.read(count * 8), dtype=np.int64)
+                if len(positions) and positions.max() >= len(vector):
+                    vector = np.concatenate([vector, np.full(positions.max() + 1 - len(vector), -1, dtype=np.int64)])
+                vector[positions] = values
+        return vector
+
+    def append_snapshot(self, username, timestamp, values):
+        """Guarda un snapshot {columna: valor}. Devuelve [(columna, anterior, nuevo)] de lo que cambió."""
+        with self.lock:
+            new_columns = [name for name in values if name not in self.column_index]
+            if new_columns:
+                for name in new_columns:
+                    self.column_index[name] = len(self.columns)
+                    self.columns.append(name)
+                with open(self.columns_path, "w", encoding="utf-8") as f:
+                    json.dump(self.columns, f, ensure_ascii=False)
+
+            vector = np.full(len(self.columns), -1, dtype=np.int64)
+            for name, value in values.items():
+                vector[self.column_index[name]] = value
+
+            key = gains_player_key(username)
+            if key not in self.last_vectors:
+                # Primer snapshot desde el arranque: recuperar el último vector del archivo
+                index = self.indexes.get(key) or self._load_index(key)
+                if index is not None:
+                    self.last_vectors[key] = self._read_vector(key, index, len(index) - 1)
+                    self.since_keyframe[key] = len(index) - index.keyframes[-1]
+            previous = self.last_vectors.get(key)
+            if previous is not None and len(previous) < len(vector):
+                previous = np.concatenate([previous, np.full(len(vector) - len(previous), -1, dtype=np.int64)])
+
+            if previous is None:
+                changed = np.flatnonzero(vector >= 0)
+                old_values = np.full(len(changed), -1, dtype=np.int64)
+            else:
+                changed = np.flatnonzero(vector != previous)
+                old_values = previous[changed]
+
+            is_keyframe = previous is None or self.since_keyframe[key] >= GAINS_KEYFRAME_INTERVAL
+            with open(self._path(key), "ab") as f:
+                offset = f.tell()
+                if is_keyframe:
+                    f.write(GAINS_RECORD_HEADER.pack(timestamp, GAINS_KEYFRAME, len(vector)))
+                    f.write(vector.tobytes())
+                else:
+                    f.write(GAINS_RECORD_HEADER.pack(timestamp, GAINS_DELTA, len(changed)))
+                    f.write(changed.astype(np.uint32).tobytes())
+                    f.write(vector[changed].tobytes())
+            if key in self.indexes:
+                self.indexes[key].add(timestamp, offset, is_keyframe)
+            self.last_vectors[key] = vector
+            self.since_keyframe[key] = 1 if is_keyframe else self.since_keyframe[key] + 1
+            return [(self.columns[i], int(old), int(new)) for i, old, new in zip(changed.tolist(), old_values.tolist(), vector[changed].tolist())]
+
+    def snapshot_at(self, username, timestamp):
+        """Devuelve (timestamp real, {columna: valor}) del último snapshot <= timestamp.
+
+        Si no hay ninguno tan antiguo devuelve el primero. None si el jugador no tiene snapshots.
+        """
+        with self.lock:
+            key = gains_player_key(username)
+            index = self._index(key)
+            if index is None:
+                return None
+            position = max(bisect.bisect_right(index.timestamps, timestamp) - 1, 0)
+            vector = self._read_vector(key, index, position)
+            return index.timestamps[position], {self.columns[i]: int(v) for i, v in enumerate(vector.tolist()) if v >= 0}
+
+gains_store = None
+
+def get_gains_store():
+    global gains_store
+    if gains_store is None:
+        gains_store = GainsStore(resource_path(GAINS_DIR))
+    return gains_store
+
+def fetch_player_hiscores_json(username):
+    """Descarga todas las habilidades y actividades de un jugador como {columna: valor}. Bloqueante.
+
+    No se guardan los rangos: cambian aunque el jugador no juegue y anularían la codificación delta.
+    """
+    log_action("API CALL: GAINS", f"Realizando llamada a Hiscores OSRS (JSON) para '{username}'.")
+    r = requests.get(HISCORES_JSON_URL.format(username.replace(' ','+')), headers={'User-Agent':'Discord Bot'}, timeout=10)
+    r.raise_for_status()
+    data = r.json()
+    values = {}
+    for skill in data.get("skills", []):
+        values[f"{skill['name']}|xp"] = skill["xp"]
+        values[f"{skill['name']}|level"] = skill["level"]
+    for activity in data.get("activities", []):
+        values[f"{activity['name']}|score"] = activity["score"]
+    return values
+
+def current_week_start(timestamp):
+    """Lunes 00:00 UTC de la semana de `timestamp`."""
+    d = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    monday = (d - datetime.timedelta(days=d.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(monday.timestamp())
+
+def load_weekly_gains():
+    global weekly_gains
+    path = os.path.join(resource_path(GAINS_DIR), "weekly.json")
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                weekly_gains = json.load(f)
+        except Exception as e:
+            log_action("ERROR", "Al cargar el resumen semanal de ganancias", exception_obj=e)
+
+def save_weekly_gains():
+    path = os.path.join(resource_path(GAINS_DIR), "weekly.json")
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(weekly_gains, f, ensure_ascii=False)
+    except Exception as e:
+        log_action("ERROR", "Al guardar el resumen semanal de ganancias", exception_obj=e)
+
+def update_weekly_gains(username, changes, timestamp):
+    """Suma al resumen semanal sólo lo que cambió en este snapshot, sin releer el historial."""
+    week_start = current_week_start(timestamp)
+    if weekly_gains["week_start"] != week_start:
+        log_action("GANANCIAS", "Nueva semana: reiniciando el resumen semanal.")
+        weekly_gains["week_start"] = week_start
+        weekly_gains["gains"] = {}
+    key = gains_player_key(username)
+    weekly_gains.setdefault("names", {})[key] = username
+    player_gains = weekly_gains["gains"].setdefault(key, {})
+    for column, old, new in changes:
+        # -1 significa "sin rango": no se puede saber cuánto se ganó desde ahí
+        if old >= 0 and new > old and not column.endswith("|level"):
+            player_gains[column] = player_gains.get(column, 0) + new - old
+
+@tasks.loop(hours=GAINS_INTERVAL_HOURS)
+async def gains_collector():
+    members = list(get_clan_members())
+    if not members:
+        return
+    store = get_gains_store()
+    now = int(time.time())
+    saved = 0
+    for username in members:
+        try:
+            values = await run_upstream(HISCORES_HOST, PRIORITY_BACKGROUND, fetch_player_hiscores_json, username)
+            changes = await asyncio.to_thread(store.append_snapshot, username, now, values)
+            update_weekly_gains(username, changes, now)
+            saved += 1
+        except Exception as e:
+            log_action("ERROR", f"Al guardar snapshot de ganancias de '{username}'", exception_obj=e)
+    save_weekly_gains()
+    log_action("GANANCIAS", f"Snapshots de ganancias guardados para {saved}/{len(members)} miembros.")
+
+def format_gains(gains, limit=10):
+    """Convierte {columna: ganancia} en líneas ordenadas de mayor a menor."""
+    lines = []
+    for column, gain in sorted(gains.items(), key=lambda item: item[1], reverse=True)[:limit]:
+        name, kind = column.rsplit("|", 1)
+        lines.append(f"**{name}**: +{gain:,} {'xp' if kind == 'xp' else 'kc'}")
+    return "\n".join(lines)
+
+@tree.command(name="gains", description="Ganancias de XP y KC de un miembro del clan.")
+@app_commands.describe(username="Nombre del jugador (debe estar en la lista del clan).", periodo="Periodo a comparar.")
+@app_commands.choices(periodo=[app_commands.Choice(name=p, value=p) for p in GAINS_PERIODS])
+async def gains(interaction: discord.Interaction, username: str, periodo: app_commands.Choice[str]):
+    log_action("COMANDO SLASH: GAINS", f"Solicitud de ganancias de '{username}' ({periodo.value}) por {interaction.user.name}.")
+    await interaction.response.defer()
+    if gains_player_key(username) not in {gains_player_key(m) for m in get_clan_members()}:
+        log_action("COMANDO SLASH: GAINS", f"'{username}' no está en la lista del clan.")
+        await interaction.followup.send(f"❌ **{username}** no está en la lista del clan. Sólo se registran las ganancias de los miembros (`/addmiembro`).")
+        return
+
+    store = get_gains_store()
+    now = int(time.time())
+    latest = await asyncio.to_thread(store.snapshot_at, username, now)
+    if not latest:
+        log_action("COMANDO SLASH: GAINS", f"Sin snapshots para '{username}'.")
+        await interaction.followup.send(f"❌ Todavía no hay datos de **{username}**. Los miembros del clan se registran cada {GAINS_INTERVAL_HOURS} h.")
+        return
+
+    start_ts, start_values = await asyncio.to_thread(store.snapshot_at, username, now - GAINS_PERIODS[periodo.value])
+    end_ts, end_values = latest
+    diff = {
+        column: value - start_values[column]
+        for column, value in end_values.items()
+        if column in start_values and value > start_values[column] and not column.endswith("|level")
+    }
+    skill_gains = {c: g for c, g in diff.items() if c.endswith("|xp") and not c.startswith("Overall|")}
+    activity_gains = {c: g for c, g in diff.items() if c.endswith("|score")}
+
+    emb = discord.Embed(
+        title=f"📈 Ganancias de {username} ({periodo.value})",
+        description=f"XP total: **+{diff.get('Overall|xp', 0):,}**",
+        color=discord.Color.gold()
+    )
+    emb.add_field(name="Habilidades", value=format_gains(skill_gains) or "Sin cambios", inline=True)
+    emb.add_field(name="Bosses y actividades", value=format_gains(activity_gains) or "Sin cambios", inline=True)
+    emb.set_footer(text=f"Desde {datetime.datetime.fromtimestamp(start_ts):%Y-%m-%d %H:%M} hasta {datetime.datetime.fromtimestamp(end_ts):%Y-%m-%d %H:%M}")
+    await interaction.followup.send(embed=emb)
+    log_action("COMANDO SLASH: GAINS", f"Ganancias de '{username}' enviadas ({len(diff)} columnas con cambios).")
+
+@tree.command(name="resumen_semanal", description="Resumen de ganancias del clan en la semana actual.")
+async def resumen_semanal(interaction: discord.Interaction):
+    log_action("COMANDO SLASH: RESUMEN_SEMANAL", f"Solicitud de resumen semanal por {interaction.user.name}.")
+    await interaction.response.defer()
+    player_gains = weekly_gains["gains"]
+    if weekly_gains["week_start"] != current_week_start(time.time()) or not player_gains:
+        await interaction.followup.send("Todavía no hay ganancias registradas esta semana.")
+        return
+
+    names = weekly_gains.get("names", {})
+    xp_ranking = sorted(((g.get("Overall|xp", 0), names.get(p, p)) for p, g in player_gains.items()), reverse=True)[:10]
+    boss_ranking = sorted(
+        ((gain, names.get(player, player), column.rsplit("|", 1)[0]) for player, g in player_gains.items() for column, gain in g.items() if column.endswith("|score")),
+        reverse=True
+    )[:10]
+
+    emb = discord.Embed(
+        title="🗓️ Resumen semanal del clan",
+        color=discord.Color.purple()
+    )
+    emb.add_field(name="XP ganada", value="\n".join(f"**{i}.** {p}: +{xp:,} xp" for i, (xp, p) in enumerate(xp_ranking, 1) if xp) or "Sin cambios", inline=False)
+    emb.add_field(name="Kills", value="\n".join(f"{p}: +{kc:,} {name}" for kc, p, name in boss_ranking) or "Sin cambios", inline=False)
+    emb.set_footer(text=f"Semana desde {datetime.datetime.fromtimestamp(weekly_gains['week_start']):%Y-%m-%d}")
+    await interaction.followup.send(embed=emb)
+    log_action("COMANDO SLASH: RESUMEN_SEMANAL", f"Resumen semanal enviado ({len(player_gains)} jugadores).")
+
+# ---- INFORME DE MEMORIA ----
+
+def get_rss_bytes():
+    """RSS actual del proceso (Linux), o el pico de RSS en otros Unix. None si no se puede medir."""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+def build_memory_report(top=5):
+    """Resume el uso de memoria del perfil actual: RSS, tracemalloc y tamaño de las cachés."""
+    rss = get_rss_bytes()
+    lines = [
+        f"Perfil: {'bajo consumo' if LOW_MEMORY_MODE else 'por defecto'}",
+        f"RSS: {rss / 1024 / 1024:.1f} MiB" if rss is not None else "RSS: no disponible",
+        f"Mensajes en caché de discord.py: {len(bot.cached_messages)}",
+        f"Miembros en caché: {sum(len(g.members) for g in bot.guilds)}",
+        f"Perfiles de Hiscores en caché: {len(player_hiscores_cache)}",
+        f"Huellas de deduplicación: {len(recent_drop_fingerprints)}",
+        f"Reenvíos: {forwarding_stats['duplicados_omitidos']} duplicados omitidos, "
+        f"{forwarding_stats['bytes_subidos'] / 1024 / 1024:.1f} MiB subidos, "
+        + ", ".join(f"{mode} {count}" for mode, count in forwarding_stats["reenvios_por_modo"].items()),
+    ]
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"tracemalloc: {current / 1024 / 1024:.1f} MiB actuales, {peak / 1024 / 1024:.1f} MiB pico")
+        for stat in tracemalloc.take_snapshot().statistics("filename")[:top]:
+            lines.append(f"  {stat.size / 1024:.0f} KiB en {stat.count} bloques: {stat.traceback[0].filename}")
+    else:
+        lines.append("tracemalloc: desactivado (usa MEMORY_TRACE=1 para medir asignaciones)")
+    return "\n".join(lines)
+
+@tree.command(name="memoria", description="Muestra el consumo de memoria del bot.")
+@app_commands.default_permissions(manage_guild=True)
+async def memoria(interaction: discord.Interaction):
+    log_action("COMANDO SLASH: MEMORIA", f"Solicitud de informe de memoria por {interaction.user.name}.")
+    await interaction.response.defer(ephemeral=True)
+    report = build_memory_report()
+    log_action("INFORME MEMORIA", report.replace("\n", " | "))
+    await interaction.followup.send(f"```\n{report}\n```", ephemeral=True)
+
+def build_upstream_report():
+    """Resume el estado del planificador (esperas, limitadas) y de los circuitos de cada API."""
+    lines = []
+    for host, scheduler in upstream_hosts.items():
+        scheduler.bucket.refill()
+        lines.append(f"{host}: {scheduler.bucket.tokens:.1f}/{scheduler.bucket.capacity} tokens, {len(scheduler.waiters)} en cola")
+        for priority, stats in scheduler.stats.items():
+            if not stats["peticiones"] and not stats["limitadas"]:
+                continue
+            avg = stats["espera_total"] / stats["peticiones"] if stats["peticiones"] else 0
+            lines.append(f"  {PRIORITY_NAMES[priority]}: {stats['peticiones']} peticiones, espera media {avg * 1000:.0f} ms, máx {stats['espera_max'] * 1000:.0f} ms, {stats['limitadas']} limitadas")
+    lines.append("")
+    for endpoint in (hiscores_personal_endpoint, hiscores_lite_endpoint, wiki_mapping_endpoint, wiki_latest_endpoint):
+        state = "abierto" if endpoint.breaker.opened_at is not None else "cerrado"
+        lines.append(f"{endpoint.name}: circuito {state}, {endpoint.breaker.failures} fallos seguidos, {len(endpoint.cache)} en caché")
+    return "\n".join(lines)
+
+@tree.command(name="estado_apis", description="Muestra el estado de las llamadas a APIs externas.")
+@app_commands.default_permissions(manage_guild=True)
+async def estado_apis(interaction: discord.Interaction):
+    log_action("COMANDO SLASH: ESTADO_APIS", f"Solicitud de estado de APIs por {interaction.user.name}.")
+    await interaction.response.defer(ephemeral=True)
+    report = build_upstream_report()
+    log_action("ESTADO APIS", report.replace("\n", " | "))
+    await interaction.followup.send(f"```\n{report[:1900]}\n```", ephemeral=True)
+
+# ---- PERFILADO BAJO DEMANDA ----
+
+class SlowCallbackCollector(logging.Handler):
+    """Recoge los avisos "Executing <Handle ...> took X seconds" del modo debug de asyncio."""
+
+    def __init__(self, records):
+        super().__init__(logging.WARNING)
+        self.records = records
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith("Executing") and len(self.records) < PROFILE_MAX_SLOW_CALLBACKS:
+            self.records.append(message)
+
+class ProfilingSession:
+    """Ventana de perfilado: cProfile del hilo del event loop, tracemalloc y callbacks lentos.
+
+    Mientras no hay sesión activa no se instala nada, así que el coste es nulo.
+    """
+
+    def __init__(self, slow_callback_ms):
+        self.slow_callback_ms = slow_callback_ms
+        self.started_at = None
+        self.stopped_at = None
+        self.profiler = cProfile.Profile()
+        self.slow_callbacks = []
+        self.collector = SlowCallbackCollector(self.slow_callbacks)
+        self.owns_tracemalloc = False
+        self.snapshot_start = None
+        self.snapshot_end = None
+        self.previous_debug = False
+        self.previous_slow_callback_duration = 0.1
+        self.auto_stop_handle = None
+
+    @property
+    def running(self):
+        return self.started_at is not None and self.stopped_at is None
+
+    def start(self, loop):
+        self.started_at = time.time()
+        self.owns_tracemalloc = not tracemalloc.is_tracing()
+        if self.owns_tracemalloc:
+            tracemalloc.start()
+        self.snapshot_start = tracemalloc.take_snapshot()
+
+        self.previous_debug = loop.get_debug()
+        self.previous_slow_callback_duration = loop.slow_callback_duration
+        loop.slow_callback_duration = self.slow_callback_ms / 1000
+        loop.set_debug(True)
+        logging.getLogger("asyncio").addHandler(self.collector)
+
+        # Se activa desde un comando, es decir, en el hilo del event loop
+        self.profiler.enable()
+
+    def stop(self, loop):
+        self.profiler.disable()
+        logging.getLogger("asyncio").removeHandler(self.collector)
+        loop.set_debug(self.previous_debug)
+        loop.slow_callback_duration = self.previous_slow_callback_duration
+
+        self.snapshot_end = tracemalloc.take_snapshot()
+        if self.owns_tracemalloc:
+            tracemalloc.stop()
+        self.stopped_at = time.time()
+        if self.auto_stop_handle:
+            self.auto_stop_handle.cancel()
+
+    def dump(self):
+        """Escribe los resultados en PROFILE_DIR y devuelve un resumen corto para Discord."""
+        if self.running:
+            # Fotos intermedias sin detener la sesión
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler)
+            self.profiler.enable()
+            snapshot_end = tracemalloc.take_snapshot()
+        else:
+            stats = pstats.Stats(self.profiler)
+            snapshot_end = self.snapshot_end
+
+        directory = resource_path(PROFILE_DIR)
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, f"profile_{datetime.datetime.fromtimestamp(self.started_at):%Y%m%d_%H%M%S}")
+
+        stats.dump_stats(prefix + ".prof")
+        with open(prefix + "_cpu.txt", "w", encoding="utf-8") as f:
+            stats.stream = f
+            stats.sort_stats("cumulative").print_stats(50)
+
+        memory_diff = [
+            stat for stat in snapshot_end.compare_to(self.snapshot_start, "lineno")
+            if not stat.traceback[0].filename.endswith(("tracemalloc.py", "cProfile.py"))
+        ]
+        with open(prefix + "_memoria.txt", "w", encoding="utf-8") as f:
+            for stat in memory_diff[:100]:
+                f.write(f"{stat}\n")
+
+        with open(prefix + "_callbacks_lentos.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(self.slow_callbacks))
+
+        elapsed = (self.stopped_at or time.time()) - self.started_at
+        top_cpu = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:5]
+        lines = [f"Ventana: {elapsed:.0f}s ({'en curso' if self.running else 'detenida'})", "", "CPU (tiempo acumulado):"]
+        for (filename, lineno, func), (_, ncalls, _, cumtime, _) in top_cpu:
+            lines.append(f"  {cumtime:.3f}s {ncalls}x {func} ({os.path.basename(filename)}:{lineno})")
+        lines.append("")
+        lines.append("Memoria (crecimiento):")
+        for stat in memory_diff[:5]:
+            frame = stat.traceback[0]
+            lines.append(f"  {stat.size_diff / 1024:+.0f} KiB {os.path.basename(frame.filename)}:{frame.lineno}")
+        lines.append("")
+        lines.append(f"Callbacks > {self.slow_callback_ms} ms: {len(self.slow_callbacks)}")
+        for message in self.slow_callbacks[:3]:
+            lines.append(f"  {message[:150]}")
+        lines.append("")
+        lines.append(f"Archivos: {os.path.basename(prefix)}.*")
+        return "\n".join(lines)
+
+profiling_session = None
+
+def auto_stop_profiling(loop):
+    if profiling_session and profiling_session.running:
+        profiling_session.stop(loop)
+        log_action("PERFILADO", f"Sesión de perfilado detenida automáticamente tras {PROFILE_MAX_SECONDS}s.")
+
+@tree.command(name="profile", description="Perfila el bot durante una ventana de tiempo.")
+@app_commands.describe(accion="start, stop o dump.", umbral_ms="Duración a partir de la cual un callback se considera lento.")
+@app_commands.choices(accion=[
+    app_commands.Choice(name="start", value="start"),
+    app_commands.Choice(name="stop", value="stop"),
+    app_commands.Choice(name="dump", value="dump")
+])
+@app_commands.default_permissions(administrator=True)
+async def profile(interaction: discord.Interaction, accion: app_commands.Choice[str], umbral_ms: app_commands.Range[int, 1] = 100):
+    global profiling_session
+    log_action("COMANDO SLASH: PROFILE", f"Solicitud de perfilado '{accion.value}' por {interaction.user.name}.")
+    await interaction.response.defer(ephemeral=True)
+    loop = asyncio.get_running_loop()
+
+    if accion.value == "start":
+        if profiling_session and profiling_session.running:
+            await interaction.followup.send("❌ Ya hay una sesión de perfilado en curso. Usa `/profile stop`.", ephemeral=True)
+            return
+        profiling_session = ProfilingSession(umbral_ms)
+        profiling_session.start(loop)
+        profiling_session.auto_stop_handle = loop.call_later(PROFILE_MAX_SECONDS, auto_stop_profiling, loop)
+        log_action("PERFILADO", f"Sesión iniciada (callbacks lentos > {umbral_ms} ms, máximo {PROFILE_MAX_SECONDS}s).")
+        await interaction.followup.send(f"✅ Perfilado iniciado. Se detendrá solo en {PROFILE_MAX_SECONDS // 60} minutos.", ephemeral=True)
+        return
+
+    if not profiling_session:
+        await interaction.followup.send("❌ No hay ninguna sesión de perfilado. Usa `/profile start`.", ephemeral=True)
+        return
+
+    try:
+        if accion.value == "stop":
+            if not profiling_session.running:
+                await interaction.followup.send("❌ La sesión de perfilado ya estaba detenida. Usa `/profile dump`.", ephemeral=True)
+                return
+            profiling_session.stop(loop)
+            log_action("PERFILADO", "Sesión de perfilado detenida.")
+
+        summary = profiling_session.dump()
+        log_action("PERFILADO", f"Resultados escritos en {PROFILE_DIR}.")
+        await interaction.followup.send(f"```\n{summary[:1900]}\n```", ephemeral=True)
+    except Exception as e:
+        log_action("ERROR", "Al generar los resultados del perfilado", exception_obj=e)
+        await interaction.followup.send("❌ Error al generar los resultados del perfilado.", ephemeral=True)
+
 @tree.command(name="establecer_canal_anything", description="Establece el ID del canal 'anything' para procesar mensajes.")
 @app_commands.describe(id_del_canal="ID numérico del canal de Discord.")
 @app_commands.default_permissions(manage_guild=True) # Requiere permisos de "Gestionar Servidor"
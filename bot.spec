@@ -24,6 +24,7 @@ a = Analysis(
         'discord.ext',
         'dotenv',
         'asyncio',
+        'numpy',
     ],
     hookspath=[],
     hooksconfig={},